@@ -1,111 +1,187 @@
 import os
 import json
 import random
+import asyncio
+import uuid
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
-from openai import OpenAI
+from typing import Dict, Any, List, Optional, Tuple
+from openai import AsyncOpenAI
+from sqlalchemy import select, update, delete, func, case, and_, or_
+
+from cache import TTLCache
+from catalogue import catalogue, mark_stock_changed
+from llm_cache import llm_cache, normalise_prompt
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+# Point at a local OpenAI-compatible server (e.g. a latency-injecting stub) when set.
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+LLM_MODEL = os.environ.get("LLM_MODEL", "gpt-4o-mini")
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 8))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 16))
+CART_RESERVATION_TTL = int(os.environ.get("CART_RESERVATION_TTL", 900))
+MESSAGE_ENRICHMENT_TTL = int(os.environ.get("MESSAGE_ENRICHMENT_TTL", 600))
 openai_client = None
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
 
 def get_openai_client():
     global openai_client
     if openai_client is None and OPENAI_API_KEY:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
+        # Retries would stretch a call past LLM_TIMEOUT; every caller has a fallback message instead.
+        openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, timeout=LLM_TIMEOUT, max_retries=0)
     return openai_client
 
-def ai_generate_response(system_prompt: str, user_message: str) -> str:
-    client = get_openai_client()
-    if not client:
-        return None
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+async def _complete(client, system_prompt: str, user_message: str) -> str:
+    async with llm_semaphore:
+        response = await client.chat.completions.create(
+            model=LLM_MODEL,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_message}
             ],
             max_tokens=500
         )
-        return response.choices[0].message.content
+    return response.choices[0].message.content
+
+async def _generate(client, system_prompt: str, user_message: str, timeout: Optional[float]) -> Optional[str]:
+    try:
+        return await asyncio.wait_for(
+            _complete(client, system_prompt, user_message),
+            timeout=LLM_TIMEOUT if timeout is None else timeout
+        )
+    except asyncio.TimeoutError:
+        print("OpenAI error: timed out")
+        return None
     except Exception as e:
         print(f"OpenAI error: {e}")
         return None
 
+async def ai_generate_response(
+    system_prompt: str,
+    user_message: str,
+    timeout: Optional[float] = None,
+    cache: bool = True,
+    placeholders: Optional[Dict[str, str]] = None
+) -> Optional[str]:
+    """Returns the completion, or None when the LLM is unavailable, slow or failing.
+
+    At most LLM_MAX_CONCURRENCY calls are in flight; the timeout covers the wait
+    for a slot as well as the request itself. With `cache`, the answer is served
+    from llm_cache under the whitespace-collapsed prompt; pass cache=False for
+    prompts carrying free text from the customer. Each `placeholders` key found
+    in the answer (e.g. "{total}") is replaced by its value after the lookup,
+    so one cached answer can quote different exact amounts.
+    """
+    client = get_openai_client()
+    if not client:
+        return None
+    if not cache:
+        message = await _generate(client, system_prompt, user_message, timeout)
+    else:
+        key = llm_cache.key(LLM_MODEL, system_prompt, normalise_prompt(user_message))
+        message = await llm_cache.get_or_create(key, lambda: _generate(client, system_prompt, user_message, timeout))
+    if message and placeholders:
+        for placeholder, value in placeholders.items():
+            message = message.replace(placeholder, value)
+    return message
+
+
+# Deferred agent messages: enrichment id -> {"status", "message"}, plus the task still producing it.
+message_enrichments = TTLCache(maxsize=10000, ttl=MESSAGE_ENRICHMENT_TTL)
+enrichment_tasks: Dict[str, asyncio.Task] = {}
+
+def enrich_later(system_prompt: str, user_message: str, fallback: str, placeholders: Optional[Dict[str, str]] = None) -> str:
+    """Starts generating a message in the background and returns its enrichment id.
+
+    Until the task finishes the entry holds `fallback`, which the caller should
+    already have sent to the client.
+    """
+    enrichment_id = uuid.uuid4().hex
+    message_enrichments.set(enrichment_id, {"status": "pending", "message": fallback})
+    
+    async def run():
+        try:
+            ai_message = await ai_generate_response(system_prompt, user_message, placeholders=placeholders)
+            message_enrichments.set(enrichment_id, {"status": "ready", "message": ai_message or fallback})
+        finally:
+            enrichment_tasks.pop(enrichment_id, None)
+    
+    enrichment_tasks[enrichment_id] = asyncio.create_task(run())
+    return enrichment_id
+
+async def get_enrichment(enrichment_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+    """Returns the entry, first waiting up to `wait` seconds for a pending one to finish."""
+    task = enrichment_tasks.get(enrichment_id)
+    if task is not None and wait > 0:
+        await asyncio.wait({task}, timeout=min(wait, LLM_TIMEOUT))
+    return message_enrichments.get(enrichment_id)
+
 
 class RecommendationAgent:
     def __init__(self, db_session):
         self.db = db_session
     
-    def get_recommendations(self, user_id: int, limit: int = 6) -> Dict[str, Any]:
+    async def get_preferred_category(self, user_id: int) -> Optional[str]:
         from database import Product, Order, OrderItem
         
-        past_categories = []
-        orders = self.db.query(Order).filter(Order.user_id == user_id).all()
-        for order in orders:
-            for item in order.items:
-                past_categories.append(item.product.category)
-        
-        if past_categories:
-            preferred_category = max(set(past_categories), key=past_categories.count)
-            recommended = self.db.query(Product).filter(
-                Product.category == preferred_category
-            ).limit(limit).all()
-        else:
-            recommended = self.db.query(Product).order_by(Product.id).limit(limit).all()
-        
+        # Most purchased category, counted per order line in one grouped query.
+        return await self.db.scalar(
+            select(Product.category)
+            .join(OrderItem, OrderItem.product_id == Product.id)
+            .join(Order, Order.id == OrderItem.order_id)
+            .where(Order.user_id == user_id)
+            .group_by(Product.category)
+            .order_by(func.count(OrderItem.id).desc())
+            .limit(1)
+        )
+    
+    async def get_ai_message(self, preferred_category: Optional[str]) -> str:
+        """Needs no database access, so callers may run it alongside other queries."""
         ai_message = None
-        if past_categories and OPENAI_API_KEY:
+        if preferred_category and OPENAI_API_KEY:
             prompt = f"Based on the customer's purchase history showing preference for {preferred_category}, generate a friendly 1-2 sentence personalized recommendation message."
-            ai_message = ai_generate_response(
+            ai_message = await ai_generate_response(
                 "You are a helpful shopping assistant. Be friendly and concise.",
                 prompt
             )
-        
+        return ai_message or "Here are some products you might like!"
+    
+    async def recommend(self, preferred_category: Optional[str], limit: int = 6) -> Dict[str, Any]:
+        recommended = (await catalogue.products_in_category(self.db, preferred_category))[:limit]
         return {
-            "products": [
-                {
-                    "id": p.id,
-                    "pid": p.pid,
-                    "title": p.title,
-                    "description": p.description,
-                    "category": p.category,
-                    "price": p.price
-                }
-                for p in recommended
-            ],
-            "ai_message": ai_message or "Here are some products you might like!",
-            "based_on": preferred_category if past_categories else "popular items"
+            "products": [dict(p) for p in recommended],
+            "ai_message": None,
+            "based_on": preferred_category or "popular items"
         }
+    
+    async def get_recommendations(self, user_id: int, limit: int = 6) -> Dict[str, Any]:
+        preferred_category = await self.get_preferred_category(user_id)
+        ai_message = asyncio.create_task(self.get_ai_message(preferred_category))
+        try:
+            result = await self.recommend(preferred_category, limit)
+            result["ai_message"] = await ai_message
+        finally:
+            ai_message.cancel()
+        return result
 
 
 class InventoryAgent:
     def __init__(self, db_session):
         self.db = db_session
     
-    def get_inventory(self, category: Optional[str] = None) -> Dict[str, Any]:
-        from database import Product
-        
-        query = self.db.query(Product)
-        if category:
-            query = query.filter(Product.category == category)
-        
-        products = query.all()
+    async def get_inventory(self, category: Optional[str] = None) -> Dict[str, Any]:
+        products = await catalogue.products_in_category(self.db, category or None)
+        stock_levels = await catalogue.stock_levels(self.db, [p["id"] for p in products])
         
         inventory = []
         for p in products:
-            total_stock = p.stock_s + p.stock_m + p.stock_l + p.stock_xl
+            stock = stock_levels.get(p["id"], {})
+            total_stock = sum(stock.values())
             inventory.append({
-                "pid": p.pid,
-                "title": p.title,
-                "category": p.category,
-                "price": p.price,
-                "stock": {
-                    "S": p.stock_s,
-                    "M": p.stock_m,
-                    "L": p.stock_l,
-                    "XL": p.stock_xl
-                },
+                "pid": p["pid"],
+                "title": p["title"],
+                "category": p["category"],
+                "price": p["price"],
+                "stock": stock,
                 "total_stock": total_stock,
                 "availability": "In Stock" if total_stock > 0 else "Out of Stock"
             })
@@ -116,32 +192,192 @@ class InventoryAgent:
             "inventory": inventory
         }
     
-    def check_stock(self, product_id: int, size: str) -> Dict[str, Any]:
-        from database import Product
+    async def check_stock(self, product_id: int, size: str, store_id: Optional[int] = None) -> Dict[str, Any]:
+        from database import ProductStock
         
-        product = self.db.query(Product).filter(Product.id == product_id).first()
+        product = await catalogue.get_product(self.db, product_id)
         if not product:
             return {"available": False, "message": "Product not found"}
         
-        size_map = {"S": "stock_s", "M": "stock_m", "L": "stock_l", "XL": "stock_xl"}
-        stock_field = size_map.get(size.upper(), "stock_m")
-        available_qty = getattr(product, stock_field, 0)
+        if store_id is None:
+            available_qty = (await catalogue.stock_levels(self.db, [product_id]))[product_id].get(size.upper(), 0)
+        else:
+            available_qty = await self.db.scalar(select(ProductStock.qty - ProductStock.reserved).where(
+                ProductStock.product_id == product_id,
+                ProductStock.size == size.upper(),
+                ProductStock.store_id == store_id
+            )) or 0
         
         return {
             "available": available_qty > 0,
             "quantity": available_qty,
             "message": f"{available_qty} units available" if available_qty > 0 else "Out of stock"
         }
+    
+    async def reserve_stock(self, user_id: int, product_id: int, size: str, quantity: int) -> bool:
+        """Holds `quantity` units for the user's cart for CART_RESERVATION_TTL seconds."""
+        from database import ProductStock, StockReservation
+        
+        if quantity <= 0:
+            return False
+        
+        size = size.upper()
+        result = await self.db.execute(
+            update(ProductStock)
+            .where(
+                ProductStock.product_id == product_id,
+                ProductStock.size == size,
+                ProductStock.store_id.is_(None),
+                ProductStock.qty - ProductStock.reserved >= quantity
+            )
+            .values(reserved=ProductStock.reserved + quantity)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            return False
+        
+        expires_at = datetime.utcnow() + timedelta(seconds=CART_RESERVATION_TTL)
+        extended = await self.db.execute(
+            update(StockReservation)
+            .where(
+                StockReservation.user_id == user_id,
+                StockReservation.product_id == product_id,
+                StockReservation.size == size,
+                StockReservation.store_id.is_(None)
+            )
+            .values(qty=StockReservation.qty + quantity, expires_at=expires_at)
+            .execution_options(synchronize_session=False)
+        )
+        if extended.rowcount == 0:
+            self.db.add(StockReservation(
+                user_id=user_id, product_id=product_id, size=size, qty=quantity, expires_at=expires_at
+            ))
+        mark_stock_changed(self.db, [product_id])
+        return True
+    
+    async def claim_reservations(self, user_id: int, product_id: Optional[int] = None, size: Optional[str] = None) -> Dict[Tuple[int, str], int]:
+        """Deletes the user's reservations and returns the held quantity per (product_id, size).
+        
+        Deleting first means a reservation is released exactly once even if the
+        expiry sweeper runs concurrently; whoever deletes the row owns its units.
+        """
+        from database import StockReservation
+        
+        stmt = delete(StockReservation).where(StockReservation.user_id == user_id, StockReservation.store_id.is_(None))
+        if product_id is not None:
+            stmt = stmt.where(StockReservation.product_id == product_id, StockReservation.size == size.upper())
+        rows = await self.db.execute(
+            stmt.returning(StockReservation.product_id, StockReservation.size, StockReservation.qty)
+            .execution_options(synchronize_session=False)
+        )
+        held: Dict[Tuple[int, str], int] = {}
+        for row in rows:
+            held[(row.product_id, row.size)] = held.get((row.product_id, row.size), 0) + row.qty
+        return held
+    
+    async def release_reservations(self, user_id: int, product_id: Optional[int] = None, size: Optional[str] = None):
+        await self.release_held(await self.claim_reservations(user_id, product_id, size))
+    
+    async def release_expired_reservations(self) -> int:
+        from database import StockReservation
+        
+        rows = (await self.db.execute(
+            delete(StockReservation)
+            .where(StockReservation.expires_at <= datetime.utcnow(), StockReservation.store_id.is_(None))
+            .returning(StockReservation.product_id, StockReservation.size, StockReservation.qty)
+            .execution_options(synchronize_session=False)
+        )).all()
+        held: Dict[Tuple[int, str], int] = {}
+        for row in rows:
+            held[(row.product_id, row.size)] = held.get((row.product_id, row.size), 0) + row.qty
+        await self.release_held(held)
+        return len(rows)
+    
+    async def release_held(self, held: Dict[Tuple[int, str], int]):
+        """Returns claimed reservation units to sale in one UPDATE."""
+        from database import ProductStock
+        
+        if not held:
+            return
+        matches = [
+            (and_(ProductStock.product_id == product_id, ProductStock.size == size), quantity)
+            for (product_id, size), quantity in held.items()
+        ]
+        await self.db.execute(
+            update(ProductStock)
+            .where(ProductStock.store_id.is_(None), or_(*[match for match, _ in matches]))
+            .values(reserved=ProductStock.reserved - case(*matches))
+            .execution_options(synchronize_session=False)
+        )
+        mark_stock_changed(self.db, {product_id for product_id, _ in held})
+    
+    async def decrement_stock(
+        self,
+        lines: List[Tuple[int, str, int]],
+        held: Optional[Dict[Tuple[int, str], int]] = None,
+        store_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Takes (product_id, size, quantity) lines out of stock with one conditional UPDATE.
+        
+        Units in `held` (from claim_reservations) are converted from reserved to sold;
+        the rest must come from unreserved stock. Each row only changes if it still
+        has enough, so concurrent checkouts cannot oversell. Lines that could not be
+        fulfilled are returned; the caller must roll back if any are, since the other
+        lines were already applied. Non-positive quantities are returned without
+        touching stock, since they would add units back.
+        """
+        from database import ProductStock
+        
+        invalid = [
+            {"product_id": product_id, "size": size.upper(), "requested": quantity}
+            for product_id, size, quantity in lines if quantity <= 0
+        ]
+        if invalid:
+            return invalid
+        
+        held = held or {}
+        wanted: Dict[Tuple[int, str], int] = {}
+        for product_id, size, quantity in lines:
+            key = (product_id, size.upper())
+            wanted[key] = wanted.get(key, 0) + quantity
+        
+        matches = [
+            (and_(ProductStock.product_id == product_id, ProductStock.size == size), quantity, held.get((product_id, size), 0))
+            for (product_id, size), quantity in wanted.items()
+        ]
+        store_match = ProductStock.store_id.is_(None) if store_id is None else ProductStock.store_id == store_id
+        stmt = (
+            update(ProductStock)
+            .where(store_match, or_(*[
+                and_(match, ProductStock.qty - ProductStock.reserved + claimed >= quantity)
+                for match, quantity, claimed in matches
+            ]))
+            .values(
+                qty=ProductStock.qty - case(*[(match, quantity) for match, quantity, _ in matches]),
+                reserved=ProductStock.reserved - case(*[(match, claimed) for match, _, claimed in matches])
+            )
+            .returning(ProductStock.product_id, ProductStock.size)
+            .execution_options(synchronize_session=False)
+        )
+        updated = {(row.product_id, row.size) for row in await self.db.execute(stmt)}
+        mark_stock_changed(self.db, {product_id for product_id, _ in updated})
+        await self.release_held({key: quantity for key, quantity in held.items() if key not in wanted})
+        
+        return [
+            {"product_id": product_id, "size": size, "requested": quantity}
+            for (product_id, size), quantity in wanted.items()
+            if (product_id, size) not in updated
+        ]
 
 
 class LoyaltyOffersAgent:
     def __init__(self, db_session):
         self.db = db_session
     
-    def get_available_offers(self) -> List[Dict[str, Any]]:
+    async def get_available_offers(self) -> List[Dict[str, Any]]:
         from database import BankOffer
         
-        offers = self.db.query(BankOffer).filter(BankOffer.is_active == True).all()
+        offers = (await self.db.scalars(select(BankOffer).where(BankOffer.is_active == True))).all()
         return [
             {
                 "id": o.id,
@@ -154,7 +390,9 @@ class LoyaltyOffersAgent:
             for o in offers
         ]
     
-    def calculate_final_price(self, cart_total: float, selected_offer_id: Optional[int] = None) -> Dict[str, Any]:
+    async def calculate_final_price(self, cart_total: float, selected_offer_id: Optional[int] = None, defer_message: bool = False) -> Dict[str, Any]:
+        """With `defer_message` the template message is returned at once and the AI
+        text is generated in the background, fetchable by `enrichment_id`."""
         from database import BankOffer
         
         result = {
@@ -165,7 +403,7 @@ class LoyaltyOffersAgent:
         }
         
         if selected_offer_id:
-            offer = self.db.query(BankOffer).filter(BankOffer.id == selected_offer_id).first()
+            offer = await self.db.get(BankOffer, selected_offer_id)
             if offer and cart_total >= offer.min_order:
                 discount = min(cart_total * (offer.discount_percent / 100), offer.max_discount)
                 result["discount_amount"] = discount
@@ -176,18 +414,27 @@ class LoyaltyOffersAgent:
                     "saved": discount
                 }
         
+        # Amounts stay out of the prompt so every cart shares one cached answer; they are filled in afterwards.
+        amounts = {"{saved}": f"Rs.{result['discount_amount']:.0f}", "{total}": f"Rs.{cart_total:.0f}"}
+        if result["discount_amount"] > 0:
+            prompt = ("Customer saved {saved} on their purchase of {total}. Generate a short celebratory message. "
+                      "Write the amounts exactly as the placeholders {saved} and {total}.")
+        else:
+            prompt = ("Customer is purchasing items worth {total}. Suggest they could save more with bank offers in a friendly way. "
+                      "Write the amount exactly as the placeholder {total}.")
+        system_prompt = "You are a helpful shopping assistant. Keep responses to 1-2 sentences."
+        fallback = "Thank you for shopping with us!"
+        
+        if defer_message:
+            result["ai_message"] = fallback
+            result["enrichment_id"] = enrich_later(system_prompt, prompt, fallback, amounts) if OPENAI_API_KEY else None
+            return result
+        
         ai_message = None
         if OPENAI_API_KEY:
-            if result["discount_amount"] > 0:
-                prompt = f"Customer saved Rs.{result['discount_amount']:.0f} on their purchase of Rs.{cart_total:.0f}. Generate a short celebratory message."
-            else:
-                prompt = f"Customer is purchasing items worth Rs.{cart_total:.0f}. Suggest they could save more with bank offers in a friendly way."
-            ai_message = ai_generate_response(
-                "You are a helpful shopping assistant. Keep responses to 1-2 sentences.",
-                prompt
-            )
+            ai_message = await ai_generate_response(system_prompt, prompt, placeholders=amounts)
         
-        result["ai_message"] = ai_message or "Thank you for shopping with us!"
+        result["ai_message"] = ai_message or fallback
         return result
 
 
@@ -267,10 +514,10 @@ class FulfillmentAgent:
             "message": f"Expected delivery in {days} business days"
         }
     
-    def get_store_slots(self, store_id: int) -> List[Dict[str, Any]]:
+    async def get_store_slots(self, store_id: int) -> List[Dict[str, Any]]:
         from database import Store
         
-        store = self.db.query(Store).filter(Store.id == store_id).first()
+        store = await self.db.get(Store, store_id) if store_id else None
         if not store:
             return []
         
@@ -300,16 +547,16 @@ class FulfillmentAgent:
         
         return slots
     
-    def confirm_fulfillment(self, order_id: int, fulfillment_type: str, slot_id: Optional[str] = None) -> Dict[str, Any]:
+    async def confirm_fulfillment(self, order_id: int, fulfillment_type: str, slot_id: Optional[str] = None) -> Dict[str, Any]:
         from database import Order
         
-        order = self.db.query(Order).filter(Order.id == order_id).first()
+        order = await self.db.get(Order, order_id)
         if not order:
             return {"success": False, "message": "Order not found"}
         
         if fulfillment_type == "delivery":
             order.status = "processing"
-            self.db.commit()
+            await self.db.commit()
             return {
                 "success": True,
                 "message": "Your order is being processed for delivery!",
@@ -318,7 +565,7 @@ class FulfillmentAgent:
         else:
             order.store_pickup_slot = slot_id
             order.status = "ready_for_pickup"
-            self.db.commit()
+            await self.db.commit()
             return {
                 "success": True,
                 "message": "Store pickup confirmed!",
@@ -330,10 +577,10 @@ class PostPurchaseSupportAgent:
     def __init__(self, db_session):
         self.db = db_session
     
-    def track_shipment(self, order_id: int) -> Dict[str, Any]:
+    async def track_shipment(self, order_id: int) -> Dict[str, Any]:
         from database import Order
         
-        order = self.db.query(Order).filter(Order.id == order_id).first()
+        order = await self.db.get(Order, order_id)
         if not order:
             return {"found": False, "message": "Order not found"}
         
@@ -366,10 +613,10 @@ class PostPurchaseSupportAgent:
             "estimated_delivery": order.estimated_delivery.strftime("%A, %d %B %Y") if order.estimated_delivery else None
         }
     
-    def request_return(self, order_id: int, reason: str, request_type: str = "return") -> Dict[str, Any]:
+    async def request_return(self, order_id: int, reason: str, request_type: str = "return") -> Dict[str, Any]:
         from database import Order, ReturnRequest
         
-        order = self.db.query(Order).filter(Order.id == order_id).first()
+        order = await self.db.get(Order, order_id)
         if not order:
             return {"success": False, "message": "Order not found"}
         
@@ -381,14 +628,15 @@ class PostPurchaseSupportAgent:
             status="pending"
         )
         self.db.add(return_request)
-        self.db.commit()
+        await self.db.commit()
         
         ai_message = None
         if OPENAI_API_KEY:
             prompt = f"Customer wants to {request_type} an order. Reason: {reason}. Generate a helpful acknowledgment message."
-            ai_message = ai_generate_response(
+            ai_message = await ai_generate_response(
                 "You are a customer support agent. Be empathetic and helpful. Keep it to 2-3 sentences.",
-                prompt
+                prompt,
+                cache=False
             )
         
         return {
@@ -398,7 +646,7 @@ class PostPurchaseSupportAgent:
             "status": "pending"
         }
     
-    def submit_feedback(self, order_id: int, user_id: int, rating: int, comment: str) -> Dict[str, Any]:
+    async def submit_feedback(self, order_id: int, user_id: int, rating: int, comment: str) -> Dict[str, Any]:
         from database import Feedback
         
         feedback = Feedback(
@@ -408,14 +656,15 @@ class PostPurchaseSupportAgent:
             comment=comment
         )
         self.db.add(feedback)
-        self.db.commit()
+        await self.db.commit()
         
         ai_message = None
         if OPENAI_API_KEY:
             prompt = f"Customer gave a {rating}/5 rating with comment: '{comment}'. Generate a personalized thank you message."
-            ai_message = ai_generate_response(
+            ai_message = await ai_generate_response(
                 "You are a customer support agent. Be genuine and appreciative. Keep it to 1-2 sentences.",
-                prompt
+                prompt,
+                cache=False
             )
         
         return {
@@ -423,10 +672,16 @@ class PostPurchaseSupportAgent:
             "message": ai_message or "Thank you for your feedback! We appreciate you taking the time to share your experience."
         }
     
-    def get_order_history(self, user_id: int) -> List[Dict[str, Any]]:
-        from database import Order
+    async def get_order_history(self, user_id: int) -> List[Dict[str, Any]]:
+        from database import Order, OrderItem
         
-        orders = self.db.query(Order).filter(Order.user_id == user_id).order_by(Order.created_at.desc()).all()
+        rows = (await self.db.execute(
+            select(Order, func.count(OrderItem.id))
+            .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+            .where(Order.user_id == user_id)
+            .group_by(Order.id)
+            .order_by(Order.created_at.desc())
+        )).all()
         
         return [
             {
@@ -435,7 +690,7 @@ class PostPurchaseSupportAgent:
                 "total": o.final_amount,
                 "status": o.status,
                 "date": o.created_at.strftime("%d %B %Y"),
-                "items_count": len(o.items)
+                "items_count": items_count
             }
-            for o in orders
+            for o, items_count in rows
         ]
@@ -1,26 +1,41 @@
 import os
+import json
+import base64
+import binascii
 import random
+import uuid
+import secrets
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional, Any, Dict, List
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel, EmailStr
-from sqlalchemy.orm import Session
+from pydantic import BaseModel, EmailStr, Field
+from sqlalchemy import select, delete, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 import bcrypt
 from jose import JWTError, jwt
 import uvicorn
 
 from database import (
     get_db, init_db, User, Store, Product, CartItem, Order, OrderItem, 
-    BankOffer, Feedback, ReturnRequest, SessionLocal
+    BankOffer, Feedback, ReturnRequest, SessionLocal, AsyncSessionLocal, async_engine, get_pool_metrics
 )
 from ai_agents import (
     RecommendationAgent, InventoryAgent, LoyaltyOffersAgent,
-    PaymentAgent, FulfillmentAgent, PostPurchaseSupportAgent
+    PaymentAgent, FulfillmentAgent, PostPurchaseSupportAgent, get_enrichment, enrichment_tasks
 )
-from seed_data import seed_all
-from fashion_chatbot import create_initial_state, process_message
+from seed_data import seed_all, sync_embedding_index
+from cache import TTLCache
+from catalogue import catalogue, dump_json
+from llm_cache import llm_cache
+from session_store import create_session_store
+from retrieval import ProductRetriever
+from fashion_chatbot import create_initial_state, process_message, chat_catalogue, category_prompt
 
 app = FastAPI(title='Shopping Assistant API')
 
@@ -30,6 +45,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-here-change-in-production")
@@ -38,6 +54,24 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
 
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 4))
+
+RESERVATION_SWEEP_INTERVAL = float(os.environ.get("RESERVATION_SWEEP_INTERVAL", 30))
+
+# Shared secret for /api/admin/*, sent as X-Admin-Token; unset disables those routes.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
+
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 60))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+
+# Detached User rows keyed by token subject ("uid", id) or ("email", email).
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# bcrypt releases the GIL, so a small dedicated pool keeps hashing off the event loop
+# without letting a burst of logins starve the default executor.
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
 
 class UserCreate(BaseModel):
     full_name: str
@@ -58,7 +92,7 @@ class Token(BaseModel):
 class CartItemCreate(BaseModel):
     product_id: int
     size: str = "M"
-    quantity: int = 1
+    quantity: int = Field(default=1, gt=0)
 
 class CheckoutRequest(BaseModel):
     order_type: str
@@ -84,11 +118,19 @@ class SlotConfirmRequest(BaseModel):
     slot_id: str
 
 
-def verify_password(plain_password, hashed_password):
+def check_password(plain_password, hashed_password):
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
-def get_password_hash(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def hash_password(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+async def verify_password(plain_password, hashed_password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, check_password, plain_password, hashed_password)
+
+async def get_password_hash(password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, hash_password, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -96,17 +138,36 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def invalidate_cached_user(user: User):
+    user_cache.pop(("uid", user.id))
+    user_cache.pop(("email", user.email))
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     if not token:
         return None
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
+        user_id: Optional[int] = payload.get("uid")
         if email is None:
             return None
     except JWTError:
         return None
-    user = db.query(User).filter(User.email == email).first()
+    
+    cache_key = ("uid", user_id) if user_id is not None else ("email", email)
+    user = user_cache.get(cache_key)
+    if user is not None:
+        return user
+    
+    if user_id is not None:
+        user = await db.get(User, user_id)
+    else:
+        user = await db.scalar(select(User).where(User.email == email))
+    if user is None:
+        return None
+    # Detach so the cached row is never expired or refreshed by another request's session.
+    db.expunge(user)
+    user_cache.set(cache_key, user)
     return user
 
 def require_user(user: User = Depends(get_current_user)):
@@ -114,19 +175,50 @@ def require_user(user: User = Depends(get_current_user)):
         raise HTTPException(status_code=401, detail="Not authenticated")
     return user
 
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+async def sweep_expired_reservations():
+    while True:
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL)
+        try:
+            async with AsyncSessionLocal() as db:
+                released = await InventoryAgent(db).release_expired_reservations()
+                await db.commit()
+            if released:
+                print(f"Released {released} expired stock reservations")
+        except Exception as e:
+            print(f"Reservation sweep failed: {e}")
+
 
 @app.on_event('startup')
 async def startup_event():
     init_db()
     seed_all()
+    app.state.reservation_sweeper = asyncio.create_task(sweep_expired_reservations())
+    app.state.chat_catalogue_warmup = asyncio.create_task(chat_catalogue.warm())
+
+@app.on_event('shutdown')
+async def shutdown_event():
+    app.state.reservation_sweeper.cancel()
+    app.state.chat_catalogue_warmup.cancel()
+    for task in list(enrichment_tasks.values()):
+        task.cancel()
+    await chat_sessions.close()
+    await async_engine.dispose()
+    password_executor.shutdown(wait=False)
 
 
 @app.get('/api/stores')
-async def get_stores(city: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(Store)
+async def get_stores(city: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    query = select(Store)
     if city:
-        query = query.filter(Store.city == city)
-    stores = query.all()
+        query = query.where(Store.city == city)
+    stores = (await db.scalars(query)).all()
     return [
         {"id": s.id, "name": s.name, "city": s.city, "address": s.address, "phone": s.phone}
         for s in stores
@@ -136,10 +228,27 @@ async def get_stores(city: Optional[str] = None, db: Session = Depends(get_db)):
 async def get_cities():
     return ["Hyderabad", "Mumbai", "Delhi"]
 
+@app.get('/api/admin/db-pool', dependencies=[Depends(require_admin)])
+async def get_db_pool():
+    return get_pool_metrics()
+
+@app.post('/api/admin/embedding-index/sync', dependencies=[Depends(require_admin)])
+async def resync_embedding_index(rebuild: bool = False):
+    return await asyncio.to_thread(sync_embedding_index, rebuild)
+
+@app.get('/api/admin/cache', dependencies=[Depends(require_admin)])
+async def get_cache_metrics():
+    return {
+        "users": user_cache.stats(),
+        "catalogue": catalogue.stats(),
+        "llm": llm_cache.stats(),
+        "chat_sessions": await chat_sessions.stats()
+    }
+
 
 @app.post('/api/auth/register')
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.email == user_data.email).first()
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
+    existing = await db.scalar(select(User).where(User.email == user_data.email))
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
     
@@ -149,15 +258,16 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
         phone=user_data.phone,
         city=user_data.city,
         nearest_store_id=user_data.nearest_store_id,
-        password_hash=get_password_hash(user_data.password),
+        password_hash=await get_password_hash(user_data.password),
         preferences={"categories": [], "sizes": ["M"]}
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    invalidate_cached_user(user)
     
     access_token = create_access_token(
-        data={"sub": user.email},
+        data={"sub": user.email, "uid": user.id},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     
@@ -173,13 +283,13 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     }
 
 @app.post('/api/auth/login')
-async def login(user_data: UserLogin, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == user_data.email).first()
-    if not user or not verify_password(user_data.password, user.password_hash):
+async def login(user_data: UserLogin, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.email == user_data.email))
+    if not user or not await verify_password(user_data.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     access_token = create_access_token(
-        data={"sub": user.email},
+        data={"sub": user.email, "uid": user.id},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     
@@ -195,9 +305,11 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
     }
 
 @app.get('/api/auth/me')
-async def get_me(user: User = Depends(require_user), db: Session = Depends(get_db)):
-    store = db.query(Store).filter(Store.id == user.nearest_store_id).first()
-    last_order = db.query(Order).filter(Order.user_id == user.id).order_by(Order.created_at.desc()).first()
+async def get_me(user: User = Depends(require_user), db: AsyncSession = Depends(get_db)):
+    store = await db.scalar(select(Store).where(Store.id == user.nearest_store_id))
+    last_order = await db.scalar(
+        select(Order).where(Order.user_id == user.id).order_by(Order.created_at.desc()).limit(1)
+    )
     
     return {
         "id": user.id,
@@ -216,66 +328,161 @@ async def get_me(user: User = Depends(require_user), db: Session = Depends(get_d
     }
 
 
+PRODUCT_COLUMNS = {
+    "id": [Product.id],
+    "pid": [Product.pid],
+    "title": [Product.title],
+    "description": [Product.description],
+    "category": [Product.category],
+    "price": [Product.price],
+    # Filled from catalogue.stock_levels rather than selected from products.
+    "stock": [],
+}
+PRODUCT_SORT_KEYS = {
+    "id": [Product.id],
+    "price": [Product.price, Product.id],
+}
+PRODUCT_PAGE_SIZE = 100
+PRODUCT_MAX_PAGE_SIZE = 500
+# BM25 over product titles and descriptions, backing `search=`.
+product_retriever = ProductRetriever(catalogue)
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str, columns: List[Any]) -> List[Any]:
+    """The cursor's values, one per column, each checked against the column's type."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    for value, column in zip(values, columns):
+        # JSON has one number type: a float column takes ints too, and bools are never numbers here.
+        allowed = (int, float) if column.type.python_type is float else column.type.python_type
+        if isinstance(value, bool) or not isinstance(value, allowed):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def product_row_to_dict(row, fields: List[str], stock_levels: Dict[int, Dict[str, int]]) -> Dict[str, Any]:
+    data = {}
+    for field in fields:
+        if field == "stock":
+            data["stock"] = stock_levels.get(row.id, {})
+        else:
+            data[field] = getattr(row, field)
+    return data
+
+def json_response(body: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.get('/api/products')
 async def get_products(
+    request: Request,
     category: Optional[str] = None,
     search: Optional[str] = None,
-    db: Session = Depends(get_db)
+    sort: Optional[str] = None,
+    limit: int = Query(PRODUCT_PAGE_SIZE, ge=1, le=PRODUCT_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
-    query = db.query(Product)
-    if category:
-        query = query.filter(Product.category == category)
-    if search:
-        query = query.filter(Product.title.ilike(f"%{search}%"))
+    cache_key = ("products", tuple(sorted(request.query_params.multi_items())))
+    cached = catalogue.listings.get(cache_key)
+    if cached is not None:
+        return json_response(*cached)
     
-    products = query.all()
-    return [
-        {
-            "id": p.id,
-            "pid": p.pid,
-            "title": p.title,
-            "description": p.description,
-            "category": p.category,
-            "price": p.price,
-            "stock": {
-                "S": p.stock_s,
-                "M": p.stock_m,
-                "L": p.stock_l,
-                "XL": p.stock_xl
-            }
-        }
-        for p in products
-    ]
+    sort = sort or ("relevance" if search else "id")
+    descending = sort.startswith("-")
+    by_relevance = sort == "relevance" and bool(search)
+    key_columns = [Product.id] if by_relevance else PRODUCT_SORT_KEYS.get(sort.lstrip("-"))
+    if key_columns is None:
+        raise HTTPException(status_code=400, detail=f"Unsupported sort: {sort}")
+    
+    requested = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(PRODUCT_COLUMNS)
+    unknown = [f for f in requested if f not in PRODUCT_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    
+    # Sort key columns are always selected so the next cursor can be built from the last row.
+    columns = {c.key: c for c in [Product.id, *key_columns]}
+    for field in requested:
+        for column in PRODUCT_COLUMNS[field]:
+            columns.setdefault(column.key, column)
+    
+    query = select(*columns.values())
+    headers = {}
+    if by_relevance:
+        # BM25 ranks the matches in memory; the cursor is an offset into that ranking.
+        ranked = [product_id for product_id, _ in await product_retriever.search(db, search, category=category)]
+        offset = decode_cursor(cursor, [Product.id])[0] if cursor else 0
+        if offset < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        page = ranked[offset:offset + limit]
+        if offset + limit < len(ranked):
+            headers["X-Next-Cursor"] = encode_cursor([offset + limit])
+    elif search:
+        # Matches are sorted and paged on the catalogue snapshot; binding every match
+        # into one IN list could pass the driver's limit on query parameters.
+        def sort_key(product):
+            return tuple(product[c.key] for c in key_columns)
+        
+        matches = [
+            await catalogue.get_product(db, product_id)
+            for product_id, _ in await product_retriever.search(db, search, category=category)
+        ]
+        ordered = sorted((product for product in matches if product), key=sort_key, reverse=descending)
+        if cursor:
+            after = tuple(decode_cursor(cursor, key_columns))
+            ordered = [p for p in ordered if (sort_key(p) < after if descending else sort_key(p) > after)]
+        page = [product["id"] for product in ordered[:limit]]
+        if len(ordered) > limit:
+            headers["X-Next-Cursor"] = encode_cursor(list(sort_key(ordered[limit - 1])))
+    else:
+        if category:
+            query = query.where(Product.category == category)
+        if cursor:
+            key = tuple_(*key_columns)
+            after = tuple_(*decode_cursor(cursor, key_columns))
+            query = query.where(key < after if descending else key > after)
+        query = query.order_by(*[c.desc() if descending else c.asc() for c in key_columns]).limit(limit + 1)
+        
+        rows = (await db.execute(query)).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers["X-Next-Cursor"] = encode_cursor([getattr(rows[-1], c.key) for c in key_columns])
+    if search:
+        position = {product_id: i for i, product_id in enumerate(page)}
+        rows = sorted((await db.execute(query.where(Product.id.in_(page)))).all(), key=lambda row: position[row.id])
+    stock_levels = await catalogue.stock_levels(db, [row.id for row in rows]) if "stock" in requested else {}
+    cached = (dump_json([product_row_to_dict(row, requested, stock_levels) for row in rows]), headers)
+    catalogue.listings.set(cache_key, cached)
+    return json_response(*cached)
 
 @app.get('/api/products/categories')
 async def get_categories():
     return ["shirt", "pants", "belt", "ethnic", "innerwear", "athleisure"]
 
 @app.get('/api/products/{product_id}')
-async def get_product(product_id: int, db: Session = Depends(get_db)):
-    product = db.query(Product).filter(Product.id == product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    return {
-        "id": product.id,
-        "pid": product.pid,
-        "title": product.title,
-        "description": product.description,
-        "category": product.category,
-        "price": product.price,
-        "stock": {
-            "S": product.stock_s,
-            "M": product.stock_m,
-            "L": product.stock_l,
-            "XL": product.stock_xl
-        }
-    }
+async def get_product(product_id: int, db: AsyncSession = Depends(get_db)):
+    cache_key = ("product", product_id)
+    body = catalogue.responses.get(cache_key)
+    if body is None:
+        product = await catalogue.get_product(db, product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        stock = (await catalogue.stock_levels(db, [product_id]))[product_id]
+        body = dump_json({**product, "stock": stock})
+        catalogue.responses.set(cache_key, body)
+    return json_response(body)
 
 
 @app.get('/api/cart')
-async def get_cart(user: User = Depends(require_user), db: Session = Depends(get_db)):
-    items = db.query(CartItem).filter(CartItem.user_id == user.id).all()
+async def get_cart(user: User = Depends(require_user), db: AsyncSession = Depends(get_db)):
+    items = (await db.scalars(
+        select(CartItem).where(CartItem.user_id == user.id).options(joinedload(CartItem.product))
+    )).all()
     total = sum(item.product.price * item.quantity for item in items)
     
     return {
@@ -303,17 +510,21 @@ async def get_cart(user: User = Depends(require_user), db: Session = Depends(get
 async def add_to_cart(
     item: CartItemCreate,
     user: User = Depends(require_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    product = db.query(Product).filter(Product.id == item.product_id).first()
+    product = await db.get(Product, item.product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    existing = db.query(CartItem).filter(
+    inventory_agent = InventoryAgent(db)
+    if not await inventory_agent.reserve_stock(user.id, item.product_id, item.size, item.quantity):
+        raise HTTPException(status_code=409, detail="Not enough stock in this size")
+    
+    existing = await db.scalar(select(CartItem).where(
         CartItem.user_id == user.id,
         CartItem.product_id == item.product_id,
         CartItem.size == item.size
-    ).first()
+    ))
     
     if existing:
         existing.quantity += item.quantity
@@ -326,61 +537,80 @@ async def add_to_cart(
         )
         db.add(cart_item)
     
-    db.commit()
+    await db.commit()
     return {"success": True, "message": "Added to cart"}
 
 @app.delete('/api/cart/{item_id}')
 async def remove_from_cart(
     item_id: int,
     user: User = Depends(require_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    item = db.query(CartItem).filter(CartItem.id == item_id, CartItem.user_id == user.id).first()
+    item = await db.scalar(select(CartItem).where(CartItem.id == item_id, CartItem.user_id == user.id))
     if not item:
         raise HTTPException(status_code=404, detail="Cart item not found")
     
-    db.delete(item)
-    db.commit()
+    await InventoryAgent(db).release_reservations(user.id, item.product_id, item.size)
+    await db.delete(item)
+    await db.commit()
     return {"success": True}
 
 @app.delete('/api/cart')
-async def clear_cart(user: User = Depends(require_user), db: Session = Depends(get_db)):
-    db.query(CartItem).filter(CartItem.user_id == user.id).delete()
-    db.commit()
+async def clear_cart(user: User = Depends(require_user), db: AsyncSession = Depends(get_db)):
+    await InventoryAgent(db).release_reservations(user.id)
+    await db.execute(delete(CartItem).where(CartItem.user_id == user.id))
+    await db.commit()
     return {"success": True}
 
 
 @app.get('/api/agents/recommendations')
-async def get_recommendations(user: User = Depends(require_user), db: Session = Depends(get_db)):
+async def get_recommendations(user: User = Depends(require_user), db: AsyncSession = Depends(get_db)):
     agent = RecommendationAgent(db)
-    return agent.get_recommendations(user.id)
+    return await agent.get_recommendations(user.id)
 
 @app.get('/api/agents/inventory')
-async def get_inventory(category: Optional[str] = None, db: Session = Depends(get_db)):
-    agent = InventoryAgent(db)
-    return agent.get_inventory(category)
+async def get_inventory(category: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    cache_key = ("inventory", category)
+    body = catalogue.listings.get(cache_key)
+    if body is None:
+        agent = InventoryAgent(db)
+        body = dump_json(await agent.get_inventory(category))
+        catalogue.listings.set(cache_key, body)
+    return json_response(body)
 
 @app.get('/api/agents/inventory/{product_id}')
-async def check_product_stock(product_id: int, size: str = "M", db: Session = Depends(get_db)):
+async def check_product_stock(
+    product_id: int,
+    size: str = "M",
+    store_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
+):
     agent = InventoryAgent(db)
-    return agent.check_stock(product_id, size)
+    return await agent.check_stock(product_id, size, store_id)
 
 @app.get('/api/agents/offers')
-async def get_offers(db: Session = Depends(get_db)):
+async def get_offers(db: AsyncSession = Depends(get_db)):
     agent = LoyaltyOffersAgent(db)
-    return agent.get_available_offers()
+    return await agent.get_available_offers()
 
 @app.post('/api/agents/offers/calculate')
 async def calculate_discount(
     cart_total: float,
     offer_id: Optional[int] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     agent = LoyaltyOffersAgent(db)
-    return agent.calculate_final_price(cart_total, offer_id)
+    return await agent.calculate_final_price(cart_total, offer_id)
+
+@app.get('/api/agents/messages/{enrichment_id}')
+async def get_agent_message(enrichment_id: str, wait: float = 0):
+    entry = await get_enrichment(enrichment_id, wait)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Message not found or expired")
+    return entry
 
 @app.get('/api/agents/payment/options')
-async def get_payment_options(db: Session = Depends(get_db)):
+async def get_payment_options(db: AsyncSession = Depends(get_db)):
     agent = PaymentAgent(db)
     return agent.get_payment_options()
 
@@ -388,16 +618,19 @@ async def get_payment_options(db: Session = Depends(get_db)):
 async def checkout(
     request: CheckoutRequest,
     user: User = Depends(require_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    cart_items = db.query(CartItem).filter(CartItem.user_id == user.id).all()
+    cart_items = (await db.scalars(
+        select(CartItem).where(CartItem.user_id == user.id).options(joinedload(CartItem.product))
+    )).all()
     if not cart_items:
         raise HTTPException(status_code=400, detail="Cart is empty")
     
     total = sum(item.product.price * item.quantity for item in cart_items)
     
     loyalty_agent = LoyaltyOffersAgent(db)
-    price_result = loyalty_agent.calculate_final_price(total, request.offer_id)
+    # The AI message is produced after the response; clients fetch it via /api/agents/messages.
+    price_result = await loyalty_agent.calculate_final_price(total, request.offer_id, defer_message=True)
     
     payment_agent = PaymentAgent(db)
     payment_result = payment_agent.initiate_payment(
@@ -405,6 +638,18 @@ async def checkout(
     )
     
     if payment_result["status"] == "success" or payment_result["status"] == "store_pickup":
+        inventory_agent = InventoryAgent(db)
+        held = await inventory_agent.claim_reservations(user.id)
+        shortages = await inventory_agent.decrement_stock(
+            [(item.product_id, item.size, item.quantity) for item in cart_items], held
+        )
+        if shortages:
+            await db.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail={"message": "Some items in your cart are out of stock", "items": shortages}
+            )
+        
         order = Order(
             order_number=f"ORD{random.randint(100000, 999999)}",
             user_id=user.id,
@@ -423,7 +668,7 @@ async def checkout(
             order.estimated_delivery = datetime.now() + timedelta(days=delivery["delivery_days"])
         
         db.add(order)
-        db.flush()
+        await db.flush()
         
         for item in cart_items:
             order_item = OrderItem(
@@ -434,13 +679,9 @@ async def checkout(
                 price=item.product.price
             )
             db.add(order_item)
-            
-            size_field = f"stock_{item.size.lower()}"
-            current_stock = getattr(item.product, size_field, 0)
-            setattr(item.product, size_field, max(0, current_stock - item.quantity))
         
-        db.query(CartItem).filter(CartItem.user_id == user.id).delete()
-        db.commit()
+        await db.execute(delete(CartItem).where(CartItem.user_id == user.id))
+        await db.commit()
         
         response = {
             "success": True,
@@ -462,7 +703,7 @@ async def checkout(
             }
         else:
             fulfillment_agent = FulfillmentAgent(db)
-            response["store_slots"] = fulfillment_agent.get_store_slots(user.nearest_store_id)
+            response["store_slots"] = await fulfillment_agent.get_store_slots(user.nearest_store_id)
         
         return response
     else:
@@ -476,9 +717,9 @@ async def checkout(
 async def retry_payment(
     request: PaymentRetryRequest,
     user: User = Depends(require_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    order = db.query(Order).filter(Order.id == request.order_id, Order.user_id == user.id).first()
+    order = await db.scalar(select(Order).where(Order.id == request.order_id, Order.user_id == user.id))
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -490,7 +731,7 @@ async def retry_payment(
     if payment_result["status"] == "success":
         order.payment_status = "paid"
         order.payment_method = request.payment_method
-        db.commit()
+        await db.commit()
     
     return {
         "success": payment_result["status"] == "success",
@@ -501,56 +742,70 @@ async def retry_payment(
 async def confirm_pickup_slot(
     request: SlotConfirmRequest,
     user: User = Depends(require_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     fulfillment_agent = FulfillmentAgent(db)
-    return fulfillment_agent.confirm_fulfillment(request.order_id, "pickup", request.slot_id)
+    return await fulfillment_agent.confirm_fulfillment(request.order_id, "pickup", request.slot_id)
 
 
 @app.get('/api/orders')
-async def get_orders(user: User = Depends(require_user), db: Session = Depends(get_db)):
+async def get_orders(user: User = Depends(require_user), db: AsyncSession = Depends(get_db)):
     support_agent = PostPurchaseSupportAgent(db)
-    return support_agent.get_order_history(user.id)
+    return await support_agent.get_order_history(user.id)
 
 @app.get('/api/orders/{order_id}/track')
-async def track_order(order_id: int, user: User = Depends(require_user), db: Session = Depends(get_db)):
-    order = db.query(Order).filter(Order.id == order_id, Order.user_id == user.id).first()
+async def track_order(order_id: int, user: User = Depends(require_user), db: AsyncSession = Depends(get_db)):
+    order = await db.scalar(select(Order).where(Order.id == order_id, Order.user_id == user.id))
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     support_agent = PostPurchaseSupportAgent(db)
-    return support_agent.track_shipment(order_id)
+    return await support_agent.track_shipment(order_id)
 
 @app.post('/api/orders/return')
 async def request_return(
     request: ReturnRequestCreate,
     user: User = Depends(require_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     support_agent = PostPurchaseSupportAgent(db)
-    return support_agent.request_return(request.order_id, request.reason, request.request_type)
+    return await support_agent.request_return(request.order_id, request.reason, request.request_type)
 
 @app.post('/api/orders/feedback')
 async def submit_feedback(
     request: FeedbackRequest,
     user: User = Depends(require_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     support_agent = PostPurchaseSupportAgent(db)
-    return support_agent.submit_feedback(request.order_id, user.id, request.rating, request.comment)
+    return await support_agent.submit_feedback(request.order_id, user.id, request.rating, request.comment)
 
 
 @app.get('/api/dashboard')
-async def get_dashboard(user: User = Depends(require_user), db: Session = Depends(get_db)):
+async def get_dashboard(user: User = Depends(require_user), db: AsyncSession = Depends(get_db)):
     recommendation_agent = RecommendationAgent(db)
-    recommendations = recommendation_agent.get_recommendations(user.id)
-    
-    loyalty_agent = LoyaltyOffersAgent(db)
-    offers = loyalty_agent.get_available_offers()
-    
-    last_order = db.query(Order).filter(Order.user_id == user.id).order_by(Order.created_at.desc()).first()
-    
-    store = db.query(Store).filter(Store.id == user.nearest_store_id).first()
+    preferred_category = await recommendation_agent.get_preferred_category(user.id)
+    # The LLM call touches no database state, so it runs while the remaining queries share the session.
+    ai_message = asyncio.create_task(recommendation_agent.get_ai_message(preferred_category))
+    try:
+        recommendations = await recommendation_agent.recommend(preferred_category)
+        
+        loyalty_agent = LoyaltyOffersAgent(db)
+        offers = await loyalty_agent.get_available_offers()
+        
+        last_order = await db.scalar(
+            select(Order)
+            .where(Order.user_id == user.id)
+            .order_by(Order.created_at.desc())
+            .limit(1)
+            .options(selectinload(Order.items).joinedload(OrderItem.product))
+        )
+        
+        store = await db.scalar(select(Store).where(Store.id == user.nearest_store_id))
+        
+        recommendations["ai_message"] = await ai_message
+    finally:
+        ai_message.cancel()
     
     return {
         "profile": {
@@ -577,47 +832,80 @@ async def get_dashboard(user: User = Depends(require_user), db: Session = Depend
     }
 
 
-chat_sessions: Dict[str, Dict] = {}
+chat_sessions = create_session_store()
+
+def new_chat_session_id() -> str:
+    return uuid.uuid4().hex
 
 class ChatMessage(BaseModel):
     message: str
     session_id: Optional[str] = None
 
-@app.post('/api/chat')
-async def chat(data: ChatMessage):
+async def run_chat_turn(data: ChatMessage, db: AsyncSession):
+    await chat_catalogue.refresh(db)
     session_id = data.session_id
+    state = await chat_sessions.get(session_id) if session_id else None
     
-    if not session_id or session_id not in chat_sessions:
-        session_id = str(random.randint(100000, 999999))
-        chat_sessions[session_id] = create_initial_state()
+    if state is None:
+        session_id = new_chat_session_id()
+        state = create_initial_state()
     
-    state = chat_sessions[session_id]
     state = process_message(state, data.message)
-    chat_sessions[session_id] = state
     
     is_ended = state["step"] == "end"
     if is_ended:
-        del chat_sessions[session_id]
+        await chat_sessions.delete(session_id)
+    else:
+        await chat_sessions.set(session_id, state)
     
+    return session_id, state, is_ended
+
+@app.post('/api/chat')
+async def chat(data: ChatMessage, db: AsyncSession = Depends(get_db)):
+    session_id, state, is_ended = await run_chat_turn(data, db)
     return {
         "response": state["response"],
         "session_id": session_id,
         "ended": is_ended
     }
 
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post('/api/chat/stream')
+async def chat_stream(data: ChatMessage, db: AsyncSession = Depends(get_db)):
+    """Server-Sent Events variant of /api/chat: `delta` events carry the reply
+    line by line, then `done` carries the session id and whether the chat ended."""
+    # The turn runs before streaming starts, while the request's session is still open.
+    session_id, state, is_ended = await run_chat_turn(data, db)
+    
+    async def events():
+        for line in state["response"].splitlines(keepends=True):
+            yield sse_event("delta", {"text": line})
+            # Hand control back so each chunk is flushed before the next is produced.
+            await asyncio.sleep(0)
+        yield sse_event("done", {"session_id": session_id, "ended": is_ended})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post('/api/chat/reset')
 async def reset_chat(session_id: Optional[str] = None):
-    if session_id and session_id in chat_sessions:
-        del chat_sessions[session_id]
+    if session_id:
+        await chat_sessions.delete(session_id)
     return {"status": "reset", "message": "Chat session reset successfully"}
 
 @app.get('/api/chat/start')
-async def start_chat():
-    session_id = str(random.randint(100000, 999999))
-    chat_sessions[session_id] = create_initial_state()
+async def start_chat(db: AsyncSession = Depends(get_db)):
+    await chat_catalogue.refresh(db)
+    session_id = new_chat_session_id()
+    await chat_sessions.set(session_id, create_initial_state())
     return {
         "session_id": session_id,
-        "response": "👗 SMART FASHION STORE AI\n\nWhat are you shopping for? (shirts / pants / ethnic / athleisure)"
+        "response": f"👗 SMART FASHION STORE AI\n\n{category_prompt()}"
     }
 
 
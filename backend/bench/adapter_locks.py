@@ -0,0 +1,82 @@
+"""Adapter lock contention: one global lock against striped session/SKU locks.
+
+    python backend/bench/adapter_locks.py [--threads 1 2 4 8 16 32] [--ops 20000]
+
+Each thread runs `--ops` operations mixing get_session, add_to_history,
+check_inventory and reserve/release across 600 SKUs. It runs once with both
+lock pools reduced to one shared lock, as the adapter's single global RLock
+was, and once with ADAPTER_LOCK_STRIPES stripes (default 64). It reports
+the best ops/s of `--repeat` runs. It then checks that 16 threads reserving 8000 units against
+1000 in stock reserve exactly 1000.
+"""
+import argparse
+import random
+import threading
+import time
+
+import common
+
+import ey_groq_adapter as ey
+
+SKUS = [(f"bench{i:03d}", size) for i in range(300) for size in ("M", "L")]
+
+
+def workload(thread_no, ops):
+    rng = random.Random(thread_no)
+    for i in range(ops):
+        session_id = f"bench-{thread_no}-{i % 50}"
+        pid, size = SKUS[rng.randrange(len(SKUS))]
+        op = i % 4
+        if op == 0:
+            ey.get_session(session_id)
+        elif op == 1:
+            ey.add_to_history(session_id, "user", "show me shirts")
+        elif op == 2:
+            ey.check_inventory(pid, size)
+        elif ey.reserve_inventory(pid, size, 1):
+            ey.release_inventory(pid, size, 1)
+
+
+def run_threads(n, target, *args):
+    threads = [threading.Thread(target=target, args=(i, *args)) for i in range(n)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def use_locks(stripes):
+    lock = ey.StripedLock(stripes)
+    # stripes=1: sessions and SKUs share the one lock, as with the old global RLock.
+    ey.session_locks = lock
+    ey.inventory_locks = lock if stripes == 1 else ey.StripedLock(stripes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    for pid, size in SKUS:
+        ey.inventory_store.setdefault(pid, {})[size] = 1000
+    
+    print(f"{'threads':>7}  {'global lock':>11}  {'striped':>9}  ops/s")
+    for n in args.threads:
+        rates = []
+        for stripes in (1, ey.LOCK_STRIPES):
+            use_locks(stripes)
+            best = 0.0
+            for _ in range(args.repeat):
+                ey.session_store.clear()
+                best = max(best, n * args.ops / run_threads(n, workload, args.ops))
+            rates.append(best)
+        print(f"{n:>7}  {rates[0]:>10.0f}  {rates[1]:>9.0f}")
+    
+    use_locks(ey.LOCK_STRIPES)
+    ey.inventory_store["bench-hot"] = {"M": 1000}
+    reserved = []
+    run_threads(16, lambda _: reserved.extend(ey.reserve_inventory("bench-hot", "M", 1) for _ in range(500)))
+    print(f"16 threads reserved {sum(reserved)} of 8000 requested against 1000 in stock; {ey.inventory_store['bench-hot']['M']} left")
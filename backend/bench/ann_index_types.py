@@ -0,0 +1,57 @@
+"""Recall and latency of the adapter's EMBEDDING_INDEX_TYPE choices.
+
+    python backend/bench/ann_index_types.py [--vectors 100000] [--queries 1000] [--types flat ivf_flat hnsw ivf_pq]
+
+Generates `--vectors` clustered, unit-length 384-d vectors (the
+all-MiniLM-L6-v2 width) and builds each index type through make_index,
+with the IVF/HNSW/PQ settings taken from the environment as in production.
+Queries are perturbed copies of catalogue vectors. It reports recall@10
+against exact flat search, search time per query on one thread, and build
+time. It needs the adapter's dependencies (numpy, faiss, sentence-transformers).
+"""
+import argparse
+import time
+
+import common
+
+import ey_groq_adapter as ey
+
+
+def clustered(rng, n, dim, centres):
+    points = centres[rng.integers(0, len(centres), n)] + 0.35 * rng.standard_normal((n, dim))
+    return ey.l2_norm(points.astype("float32"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--types", nargs="+", default=["flat", "ivf_flat", "hnsw", "ivf_pq"])
+    args = parser.parse_args()
+    if ey.np is None:
+        raise SystemExit("numpy, faiss and sentence-transformers are required")
+    np, faiss = ey.np, ey.faiss
+    faiss.omp_set_num_threads(1)
+    
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((256, 384))
+    vectors = clustered(rng, args.vectors, 384, centres)
+    queries = ey.l2_norm(vectors[rng.integers(0, args.vectors, args.queries)] + 0.05 * rng.standard_normal((args.queries, 384)).astype("float32"))
+    ids = np.arange(args.vectors)
+    
+    exact = faiss.IndexFlatIP(384)
+    exact.add(vectors)
+    _, truth = exact.search(queries, 10)
+    
+    print(f"{args.vectors} vectors, {args.queries} queries, recall@10 against exact search")
+    for index_type in args.types:
+        # make_index reads the type from this module setting, as set by EMBEDDING_INDEX_TYPE.
+        ey.EMBEDDING_INDEX_TYPE = index_type
+        started = time.perf_counter()
+        index = ey.make_index(vectors, ids)
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        _, found = index.search(queries, 10)
+        per_query = (time.perf_counter() - started) * 1000 / args.queries
+        recall = np.mean([len(set(f) & set(t)) / 10 for f, t in zip(found, truth)])
+        print(f"  {index_type:9} {ey.index_spec(args.vectors):16} recall {recall:.3f}  {per_query:.2f} ms/query  build {built:.0f} s")
@@ -0,0 +1,78 @@
+"""Chat catalogue refresh cost on the chat request path.
+
+    python backend/bench/chat_catalogue_refresh.py [--products 100000] [--rounds 5]
+
+Builds a synthetic catalogue (4 central stock rows per product), then times
+the first CatalogueIndex.refresh and the periodic cross-worker stock resync.
+Each round changes 100 stock rows behind the process's back, as another
+worker would. It reports how long the chat turn's refresh() call took, the
+longest event-loop stall until the resync finished (measured by a 1 ms
+ticker), and whether the changes were picked up.
+"""
+import argparse
+import asyncio
+import time
+
+import common
+
+
+async def ticker(gaps, stop):
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(0.001)
+        now = time.perf_counter()
+        gaps.append((now - last) * 1000)
+        last = now
+
+
+async def main(args):
+    from sqlalchemy import text
+    from database import AsyncSessionLocal, engine, async_engine
+    from catalogue import catalogue
+    from fashion_chatbot import chat_catalogue
+    
+    async with AsyncSessionLocal() as db:
+        started = time.perf_counter()
+        await chat_catalogue.refresh(db)
+        print(f"first refresh: {(time.perf_counter() - started) * 1000:.0f} ms for {len(chat_catalogue.by_id)} products")
+        
+        turn_ms, stall_ms, picked_up = [], [], []
+        for round_no in range(args.rounds):
+            changed = list(range(1 + round_no * 100, 101 + round_no * 100))
+            with engine.begin() as conn:
+                conn.execute(
+                    text("UPDATE product_stock SET qty = 0, reserved = 0 WHERE store_id IS NULL AND product_id IN (%s)"
+                         % ",".join(map(str, changed)))
+                )
+            # Both the chat index's resync and the shared stock cache are due.
+            chat_catalogue._synced_at = 0.0
+            catalogue.stock.clear()
+            
+            gaps, stop = [], asyncio.Event()
+            ticking = asyncio.create_task(ticker(gaps, stop))
+            await asyncio.sleep(0.01)
+            started = time.perf_counter()
+            await chat_catalogue.refresh(db)
+            turn_ms.append((time.perf_counter() - started) * 1000)
+            # Background resync, if the implementation uses one.
+            pending = getattr(chat_catalogue, "_resync", None)
+            if pending is not None:
+                await pending
+            stop.set()
+            await ticking
+            stall_ms.append(max(gaps))
+            picked_up.append(all(chat_catalogue.by_id[i]["stock"] == 0 for i in changed))
+        
+        print("chat turn refresh():", common.summarize(turn_ms))
+        print("longest event-loop stall per resync:", common.summarize(stall_ms))
+        print("changes picked up:", all(picked_up))
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    common.build_catalogue(args.products)
+    asyncio.run(main(args))
@@ -0,0 +1,47 @@
+"""Memory held per chat session: ChatState against the dict state it replaced.
+
+    python backend/bench/chat_state_memory.py [--sessions 100000]
+
+Allocates `--sessions` sessions of each shape under tracemalloc and reports
+bytes per session. The dict shape is ChatState.to_dict(), which is what
+create_initial_state returned before ChatState. "Mid-chat" sessions hold a
+category, product, size, two cart lines and three recommendations. Their
+strings come from the catalogue and are shared by both shapes, so only the
+containers are counted.
+"""
+import argparse
+import tracemalloc
+
+import common
+
+from fashion_chatbot import ChatState, CartLine, Step, SIZES
+
+
+def mid_chat() -> ChatState:
+    return ChatState(
+        step=Step.RECOMMENDATION, category="shirt", product="Blue Oxford Shirt", size=SIZES["M"],
+        cart=[CartLine("Blue Oxford Shirt", SIZES["M"], 1299), CartLine("Slim Chino Pants", SIZES["L"], 1799)],
+        cart_total=3098, recommended_items=("Slim Chino Pants", "Khaki Cargo Pants", "Black Formal Trousers"),
+        price=1299
+    )
+
+
+def bytes_per_session(make, n):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [make() for _ in range(n)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    # The list holding the sessions is not part of a session.
+    return (used - sessions.__sizeof__()) / n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=100000)
+    args = parser.parse_args()
+    for name, make in [("fresh", ChatState), ("mid-chat", mid_chat)]:
+        template = make()
+        as_dict = bytes_per_session(template.to_dict, args.sessions)
+        as_state = bytes_per_session(make, args.sessions)
+        print(f"{name:9} session  dict {as_dict:5.0f} bytes  ChatState {as_state:5.0f} bytes")
@@ -0,0 +1,88 @@
+"""Concurrent checkout throughput.
+
+    python backend/bench/checkout_throughput.py [--shoppers 200] [--hot]
+
+Creates `--shoppers` users, each with one cart line, and checks them all out
+at once through the ASGI app. By default every shopper buys a different
+product; `--hot` puts every cart on the same SKU, with stock for all of them,
+so every checkout's conditional UPDATE targets one row. Reports checkouts
+per second, per-request latency and the status codes. Order numbers are
+random six-digit values, so an occasional 500 is a duplicate number, not a
+stock failure.
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+from datetime import timedelta
+
+import common
+
+
+async def main(args):
+    import httpx
+    from sqlalchemy import select
+    import app as shop
+    from database import AsyncSessionLocal, ProductStock, async_engine
+    
+    transport = httpx.ASGITransport(app=shop.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        async def checkout(headers):
+            started = time.perf_counter()
+            response = await client.post("/api/checkout", json={"order_type": "store", "payment_method": "upi"}, headers=headers)
+            return response.status_code, (time.perf_counter() - started) * 1000
+        
+        started = time.perf_counter()
+        results = await asyncio.gather(*(checkout(headers) for headers in args.shoppers_headers))
+        elapsed = time.perf_counter() - started
+    
+    print(f"{len(results)} checkouts ({'one SKU' if args.hot else 'distinct SKUs'}) in {elapsed * 1000:.0f} ms: "
+          f"{len(results) / elapsed:.0f} checkouts/s")
+    print("status codes:", dict(Counter(status for status, _ in results)))
+    print("latency:", common.summarize([ms for _, ms in results]))
+    if args.hot:
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(
+                select(ProductStock.qty, ProductStock.reserved)
+                .where(ProductStock.product_id == 1, ProductStock.size == "M", ProductStock.store_id.is_(None))
+            )).one()
+        print(f"hot SKU left: qty={row.qty} reserved={row.reserved}")
+    await async_engine.dispose()
+
+
+def create_shoppers(n, hot):
+    from sqlalchemy import insert, select, update
+    import app as shop
+    from database import engine, User, CartItem, ProductStock
+    
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"full_name": f"Shopper {i}", "email": f"shopper-{i}@example.com", "phone": "9000000000",
+             "city": "Hyderabad", "nearest_store_id": 1, "password_hash": "x", "preferences": {}}
+            for i in range(n)
+        ])
+        users = conn.execute(select(User.id, User.email).order_by(User.id)).all()
+        product_ids = [1] * n if hot else [i + 1 for i in range(n)]
+        conn.execute(insert(CartItem), [
+            {"user_id": user.id, "product_id": product_id, "size": "M", "quantity": 1}
+            for user, product_id in zip(users, product_ids)
+        ])
+        conn.execute(
+            update(ProductStock)
+            .where(ProductStock.store_id.is_(None), ProductStock.size == "M", ProductStock.product_id.in_(set(product_ids)))
+            .values(qty=n, reserved=0)
+        )
+    return [
+        {"Authorization": f"Bearer {shop.create_access_token(data={'sub': user.email, 'uid': user.id}, expires_delta=timedelta(hours=1))}"}
+        for user in users
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shoppers", type=int, default=200)
+    parser.add_argument("--hot", action="store_true", help="every cart holds the same SKU")
+    args = parser.parse_args()
+    common.build_catalogue(max(args.shoppers, 1000))
+    args.shoppers_headers = create_shoppers(args.shoppers, args.hot)
+    asyncio.run(main(args))
@@ -0,0 +1,65 @@
+"""Shared setup for the benchmark scripts in this directory.
+
+Import it before any backend module: without DATABASE_URL it points the
+backend at a fresh SQLite file, so a benchmark never touches real data.
+"""
+import os
+import sys
+import time
+import random
+import statistics
+import tempfile
+from typing import Callable, Dict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.db')}"
+os.environ.setdefault("EMBEDDING_INDEX_DIR", tempfile.mkdtemp(prefix="bench-index-"))
+
+CATEGORIES = ["shirt", "pants", "belt", "ethnic", "innerwear", "athleisure"]
+
+
+def build_catalogue(n_products: int, seed: int = 0):
+    """Creates the schema and `n_products` synthetic products, each with central stock in every size."""
+    from sqlalchemy import insert
+    from database import engine, init_db, Product, ProductStock, Store, DEFAULT_SIZES
+    
+    init_db()
+    rng = random.Random(seed)
+    with engine.begin() as conn:
+        conn.execute(insert(Store), [{"name": "Bench Store", "city": "Hyderabad"}])
+        for start in range(0, n_products, 10000):
+            ids = range(start + 1, min(start + 10000, n_products) + 1)
+            conn.execute(insert(Product), [
+                {
+                    "id": i, "pid": f"B{i:07d}", "category": CATEGORIES[i % len(CATEGORIES)],
+                    "title": f"{rng.choice(['Blue', 'Black', 'White', 'Olive'])} {CATEGORIES[i % len(CATEGORIES)]} {i}",
+                    "description": f"Cotton {CATEGORIES[i % len(CATEGORIES)]} number {i}", "price": rng.randrange(299, 4999, 50)
+                }
+                for i in ids
+            ])
+            conn.execute(insert(ProductStock), [
+                {"product_id": i, "size": size, "qty": rng.randint(0, 25)} for i in ids for size in DEFAULT_SIZES
+            ])
+
+
+def summarize(samples_ms) -> Dict[str, float]:
+    samples = sorted(samples_ms)
+    return {
+        "n": len(samples),
+        "p50_ms": round(statistics.median(samples), 2),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 2),
+        "max_ms": round(samples[-1], 2),
+    }
+
+
+def time_calls(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
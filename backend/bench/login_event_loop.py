@@ -0,0 +1,74 @@
+"""Event-loop responsiveness while logins hash passwords.
+
+    python backend/bench/login_event_loop.py [--logins 16] [--pollers 4] [--inline]
+
+Registers one user, then runs `--logins` concurrent POST /api/auth/login
+calls through the ASGI app while `--pollers` clients keep requesting a
+cheap endpoint (/api/products/categories). Reports the pollers' latency and
+the logins' wall time. Poller latency excludes the 5 ms pause between polls. `--inline` verifies passwords on the event loop, as
+login did before the password worker pool. BCRYPT_ROUNDS and
+PASSWORD_HASH_WORKERS are read from the environment as in production
+(defaults 12 and 4).
+"""
+import argparse
+import asyncio
+import time
+
+import common
+
+
+async def main(args):
+    import httpx
+    import app as shop
+    from database import async_engine
+    
+    if args.inline:
+        async def verify_on_loop(plain_password, hashed_password):
+            return shop.check_password(plain_password, hashed_password)
+        shop.verify_password = verify_on_loop
+    
+    credentials = {"email": "bench@example.com", "password": "bench-password"}
+    transport = httpx.ASGITransport(app=shop.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        response = await client.post("/api/auth/register", json={
+            **credentials, "full_name": "Bench User", "phone": "9000000000", "city": "Hyderabad", "nearest_store_id": 1
+        })
+        assert response.status_code == 200, response.text
+        
+        done = asyncio.Event()
+        poll_ms = []
+        
+        async def poll():
+            while not done.is_set():
+                # Timed from before the pause, so time the loop spends blocked counts too.
+                started = time.perf_counter()
+                await asyncio.sleep(0.005)
+                await client.get("/api/products/categories")
+                poll_ms.append((time.perf_counter() - started) * 1000 - 5)
+        
+        async def login():
+            response = await client.post("/api/auth/login", json=credentials)
+            assert response.status_code == 200, response.text
+        
+        pollers = [asyncio.create_task(poll()) for _ in range(args.pollers)]
+        await asyncio.sleep(0.1)
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(args.logins)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await asyncio.gather(*pollers)
+    
+    print(f"{args.logins} logins in {elapsed * 1000:.0f} ms ({'inline' if args.inline else f'{shop.PASSWORD_HASH_WORKERS} hash workers'})")
+    print("poller latency:", common.summarize(poll_ms))
+    shop.password_executor.shutdown(wait=False)
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=16)
+    parser.add_argument("--pollers", type=int, default=4)
+    parser.add_argument("--inline", action="store_true", help="verify passwords on the event loop")
+    args = parser.parse_args()
+    common.build_catalogue(100)
+    asyncio.run(main(args))
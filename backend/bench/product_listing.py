@@ -0,0 +1,75 @@
+"""GET /api/products page latency on a large catalogue.
+
+    python backend/bench/product_listing.py [--products 100000] [--repeat 20]
+
+Builds a synthetic catalogue (4 central stock rows per product) and times one
+100-row page at the start, middle and end of the id and price orderings,
+following a keyset cursor, against reading the whole table the way the
+endpoint did before pagination. The response cache is cleared before every
+call, so each sample runs the query.
+"""
+import argparse
+import asyncio
+import time
+
+import common
+
+
+async def main(args):
+    import httpx
+    from sqlalchemy import select
+    import app as shop
+    from catalogue import catalogue
+    from database import AsyncSessionLocal, Product, async_engine
+    
+    async with AsyncSessionLocal() as db:
+        prices = (await db.execute(select(Product.price, Product.id).order_by(Product.price, Product.id))).all()
+    
+    async def sample(client, params):
+        samples = []
+        for _ in range(args.repeat):
+            catalogue.listings.clear()
+            started = time.perf_counter()
+            response = await client.get("/api/products", params=params)
+            samples.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.text
+        return common.summarize(samples)
+    
+    transport = httpx.ASGITransport(app=shop.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        for name, fraction in [("start", 0.0), ("middle", 0.5), ("end", 0.99)]:
+            position = int(args.products * fraction)
+            id_params = {"limit": 100}
+            price_params = {"limit": 100, "sort": "price"}
+            if position:
+                id_params["cursor"] = shop.encode_cursor([position])
+                price_params["cursor"] = shop.encode_cursor(list(prices[position - 1]))
+            print(f"sort=id    page at {name}:", await sample(client, id_params))
+            print(f"sort=price page at {name}:", await sample(client, price_params))
+    
+    # The endpoint before pagination: every product and its stock in one response.
+    samples = []
+    for _ in range(max(1, args.repeat // 10)):
+        catalogue.stock.clear()
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(Product).order_by(Product.id))).scalars().all()
+            levels = await catalogue.stock_levels(db, [row.id for row in rows])
+            body = [
+                {"id": row.id, "pid": row.pid, "title": row.title, "description": row.description,
+                 "category": row.category, "price": row.price, "stock": levels.get(row.id, {})}
+                for row in rows
+            ]
+            shop.dump_json(body)
+        samples.append((time.perf_counter() - started) * 1000)
+    print("whole catalogue, unpaginated:", common.summarize(samples))
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    common.build_catalogue(args.products)
+    asyncio.run(main(args))
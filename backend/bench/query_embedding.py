@@ -0,0 +1,61 @@
+"""Query embedding throughput: one model call per query against micro-batching.
+
+    python backend/bench/query_embedding.py [--callers 1 8 64] [--queries 2000] [--simulate]
+
+`--callers` threads split `--queries` distinct queries between them and
+embed each through a QueryEmbedder. The script runs once with max_batch=1,
+which is one encode call per query as before micro-batching, and once with
+the EMBED_MAX_BATCH / EMBED_MAX_WAIT_MS settings. It reports queries per
+second and the average batch size. It needs the adapter's dependencies
+(numpy, sentence-transformers). By default it encodes with
+all-MiniLM-L6-v2. `--simulate` replaces the model with a fixed cost of
+4 ms per call plus 0.2 ms per row, which is a CPU-only MiniLM profile.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+
+import ey_groq_adapter as ey
+
+
+def simulated_encode(texts):
+    time.sleep(0.004 + 0.0002 * len(texts))
+    return ey.np.ones((len(texts), 384), dtype="float32")
+
+
+def model_encode(texts):
+    return ey.get_embedder().encode(texts, convert_to_numpy=True)
+
+
+def throughput(encode, callers, queries, max_batch):
+    embedder = ey.QueryEmbedder(encode, max_batch=max_batch)
+    per_caller = queries // callers
+    
+    def caller(n):
+        for i in range(per_caller):
+            embedder.embed(f"query {n} {i}")
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        list(pool.map(caller, range(callers)))
+    elapsed = time.perf_counter() - started
+    return per_caller * callers / elapsed, embedder.stats()["avg_batch"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--callers", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--simulate", action="store_true", help="replace the model with a fixed-cost encoder")
+    args = parser.parse_args()
+    if ey.np is None:
+        raise SystemExit("numpy and sentence-transformers are required")
+    encode = simulated_encode if args.simulate else model_encode
+    encode(["warm up"])
+    print(f"{'callers':>7}  {'batch-1 q/s':>11}  {'batched q/s':>11}  avg batch")
+    for callers in args.callers:
+        single, _ = throughput(encode, callers, args.queries, max_batch=1)
+        batched, avg_batch = throughput(encode, callers, args.queries, max_batch=ey.EMBED_MAX_BATCH)
+        print(f"{callers:>7}  {single:>11.0f}  {batched:>11.0f}  {avg_batch:>9}")
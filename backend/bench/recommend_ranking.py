@@ -0,0 +1,48 @@
+"""smart_recommend: NumPy price ranking against the pure-Python loop.
+
+    python backend/bench/recommend_ranking.py [--products 60000] [--top-k 5] [--repeat 200]
+
+Builds a synthetic catalogue (a sixth of it pants, the complement of shirt),
+loads the chat index and ranks recommendations for a shirt in the cart.
+The loop is timed by hiding the index's arrays, which is the path taken
+without NumPy. Both paths must return the same products.
+"""
+import argparse
+import asyncio
+
+import common
+
+
+async def load_index():
+    from database import AsyncSessionLocal, async_engine
+    from fashion_chatbot import chat_catalogue
+    
+    async with AsyncSessionLocal() as db:
+        await chat_catalogue.refresh(db)
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=60000)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    common.build_catalogue(args.products)
+    asyncio.run(load_index())
+    
+    from fashion_chatbot import CartLine, chat_catalogue, smart_recommend
+    
+    cart = [CartLine("Blue shirt 6", "M", 1499)]
+    candidates = len(chat_catalogue.available("pants"))
+    ranked = smart_recommend("shirt", cart, args.top_k)
+    numpy_timing = common.time_calls(lambda: smart_recommend("shirt", cart, args.top_k), args.repeat)
+    arrays, chat_catalogue.arrays = chat_catalogue.arrays, {}
+    try:
+        assert smart_recommend("shirt", cart, args.top_k) == ranked
+        loop_timing = common.time_calls(lambda: smart_recommend("shirt", cart, args.top_k), args.repeat)
+    finally:
+        chat_catalogue.arrays = arrays
+    print(f"{candidates} in-stock candidates, top {args.top_k}, identical output")
+    print("loop: ", loop_timing)
+    print("numpy:", numpy_timing)
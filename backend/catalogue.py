@@ -0,0 +1,179 @@
+import os
+import json
+import asyncio
+from itertools import chain
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from cache import TTLCache
+from database import Product, ProductStock
+
+STOCK_CACHE_TTL = float(os.environ.get("STOCK_CACHE_TTL", 5))
+STOCK_CACHE_SIZE = int(os.environ.get("STOCK_CACHE_SIZE", 100000))
+RESPONSE_CACHE_SIZE = int(os.environ.get("CATALOGUE_RESPONSE_CACHE_SIZE", 2048))
+
+# Above this many uncached ids one full-table read is cheaper than a huge IN list.
+STOCK_BULK_THRESHOLD = 500
+
+METADATA_COLUMNS = [Product.id, Product.pid, Product.title, Product.description, Product.category, Product.price]
+
+
+def dump_json(data: Any) -> bytes:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+class CatalogueCache:
+    """Read-through cache for the products table.
+
+    Product metadata only changes when products are added or edited, so it is
+    loaded once and kept until a commit adds or edits a product. Central stock
+    levels (product_stock rows without a store) change on every checkout and are cached for STOCK_CACHE_TTL seconds, or
+    dropped as soon as a commit changes them. `responses` holds pre-serialised
+    JSON bodies for single products, dropped with that product's stock;
+    `listings` holds those covering many products (product lists, inventory),
+    dropped on any stock change.
+    """
+
+    def __init__(self):
+        # (id -> product, category -> products), swapped as a unit so readers never see a mix.
+        self._snapshot: Optional[Tuple[Dict[int, Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]] = None
+        # Bumped on invalidation so a load that raced with a commit is not kept.
+        self._generation = 0
+        self._load_lock = asyncio.Lock()
+        self.stock = TTLCache(maxsize=STOCK_CACHE_SIZE, ttl=STOCK_CACHE_TTL)
+        self.responses = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=STOCK_CACHE_TTL)
+        self.listings = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=STOCK_CACHE_TTL)
+        self._listeners: List[Callable[[Optional[List[int]]], None]] = []
+
+    def subscribe(self, listener: Callable[[Optional[List[int]]], None]):
+        """Calls `listener(product_ids)` after a commit changes their stock and
+        `listener(None)` after one adds or edits products."""
+        self._listeners.append(listener)
+
+    async def _load(self, db):
+        snapshot = self._snapshot
+        if snapshot is None:
+            async with self._load_lock:
+                if self._snapshot is None:
+                    generation = self._generation
+                    rows = (await db.execute(select(*METADATA_COLUMNS).order_by(Product.id))).all()
+                    by_id: Dict[int, Dict[str, Any]] = {}
+                    by_category: Dict[str, List[Dict[str, Any]]] = {}
+                    for row in rows:
+                        product = dict(row._mapping)
+                        by_id[row.id] = product
+                        by_category.setdefault(row.category, []).append(product)
+                    snapshot = (by_id, by_category)
+                    if generation == self._generation:
+                        self._snapshot = snapshot
+                else:
+                    snapshot = self._snapshot
+        return snapshot
+
+    async def get_product(self, db, product_id: int) -> Optional[Dict[str, Any]]:
+        by_id, _ = await self._load(db)
+        return by_id.get(product_id)
+
+    async def products_in_category(self, db, category: Optional[str] = None) -> List[Dict[str, Any]]:
+        by_id, by_category = await self._load(db)
+        if category is None:
+            return list(by_id.values())
+        return by_category.get(category, [])
+
+    async def stock_levels(self, db, product_ids: Iterable[int]) -> Dict[int, Dict[str, int]]:
+        levels = {}
+        missing = []
+        for product_id in product_ids:
+            stock = self.stock.get(product_id)
+            if stock is None:
+                missing.append(product_id)
+            else:
+                levels[product_id] = stock
+        if missing:
+            query = (
+                select(ProductStock.product_id, ProductStock.size, (ProductStock.qty - ProductStock.reserved).label("available"))
+                .where(ProductStock.store_id.is_(None))
+                .order_by(ProductStock.product_id, ProductStock.id)
+            )
+            if len(missing) <= STOCK_BULK_THRESHOLD:
+                query = query.where(ProductStock.product_id.in_(missing))
+            loaded: Dict[int, Dict[str, int]] = {product_id: {} for product_id in missing}
+            for row in (await db.execute(query)).all():
+                loaded.setdefault(row.product_id, {})[row.size] = row.available
+            wanted = set(missing)
+            for product_id, stock in loaded.items():
+                self.stock.set(product_id, stock)
+                if product_id in wanted:
+                    levels[product_id] = stock
+        return levels
+
+    def invalidate_stock(self, product_ids: Iterable[int]):
+        product_ids = list(product_ids)
+        for product_id in product_ids:
+            self.stock.pop(product_id)
+            self.responses.pop(("product", product_id))
+        if product_ids:
+            self.listings.clear()
+        for listener in self._listeners:
+            listener(product_ids)
+
+    def invalidate_all(self):
+        self._generation += 1
+        self._snapshot = None
+        self.stock.clear()
+        self.responses.clear()
+        self.listings.clear()
+        for listener in self._listeners:
+            listener(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "products_loaded": len(self._snapshot[0]) if self._snapshot is not None else 0,
+            "stock": self.stock.stats(),
+            "responses": self.responses.stats(),
+            "listings": self.listings.stats(),
+        }
+
+
+catalogue = CatalogueCache()
+
+
+def pending_changes(session) -> Dict[str, Any]:
+    return session.info.setdefault("catalogue_changes", {"stock": set(), "metadata": False})
+
+
+def mark_stock_changed(session, product_ids: Iterable[int]):
+    """Records stock written by UPDATE statements, which bypass the flush hooks below."""
+    pending_changes(session)["stock"].update(product_ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_product_changes(session, flush_context):
+    changes = pending_changes(session)
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, ProductStock):
+            changes["stock"].add(obj.product_id)
+        elif isinstance(obj, Product):
+            if obj in session.dirty and not any(
+                attr.history.has_changes() for attr in inspect(obj).attrs if attr.key != "stock"
+            ):
+                continue
+            changes["metadata"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_product_changes(session):
+    changes = session.info.pop("catalogue_changes", None)
+    if not changes:
+        return
+    if changes["metadata"]:
+        catalogue.invalidate_all()
+    elif changes["stock"]:
+        catalogue.invalidate_stock(changes["stock"])
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_product_changes(session):
+    session.info.pop("catalogue_changes", None)
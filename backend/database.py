@@ -1,13 +1,109 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Text, JSON, Boolean
+import bisect
+import threading
+import time
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Text, JSON, Boolean, Index, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+ASYNC_DRIVERS = {
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def to_async_url(database_url: str) -> str:
+    url = make_url(database_url)
+    drivername = ASYNC_DRIVERS.get(url.drivername, url.drivername)
+    query = dict(url.query)
+    if drivername == "postgresql+asyncpg" and "sslmode" in query:
+        query["ssl"] = query.pop("sslmode")
+    return url.set(drivername=drivername, query=query).render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+WAIT_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+class WaitHistogram:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(WAIT_BUCKETS_MS, elapsed_ms)] += 1
+            self.total += 1
+            self.sum_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            labels = [f"le_{b}ms" for b in WAIT_BUCKETS_MS] + ["le_inf"]
+            return {
+                "count": self.total,
+                "avg_ms": round(self.sum_ms / self.total, 3) if self.total else 0.0,
+                "max_ms": round(self.max_ms, 3),
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+
+class TimedPoolMixin:
+    """Records how long each checkout waits for a connection."""
+    wait_histogram: WaitHistogram = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            self.wait_histogram.observe((time.perf_counter() - start) * 1000)
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    wait_histogram = WaitHistogram()
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    wait_histogram = WaitHistogram()
+
+
+def pool_options(database_url: str, poolclass) -> dict:
+    # SQLite (used for local runs) manages its own pool and rejects sizing arguments.
+    if make_url(database_url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+# Sync engine is kept for schema creation and seed_data.py; request handlers use the async engine.
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL, TimedQueuePool))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, TimedAsyncQueuePool))
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 class Store(Base):
@@ -43,10 +139,51 @@ class Product(Base):
     category = Column(String(100), nullable=False)
     price = Column(Float, nullable=False)
     image_url = Column(String(500))
-    stock_s = Column(Integer, default=10)
-    stock_m = Column(Integer, default=10)
-    stock_l = Column(Integer, default=10)
-    stock_xl = Column(Integer, default=10)
+    
+    stock = relationship("ProductStock", back_populates="product")
+    
+    __table_args__ = (
+        Index("ix_products_category_id", "category", "id"),
+        Index("ix_products_price_id", "price", "id"),
+    )
+
+DEFAULT_SIZES = ["S", "M", "L", "XL"]
+
+class ProductStock(Base):
+    __tablename__ = "product_stock"
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    # NULL store_id is the central stock that online orders ship from.
+    store_id = Column(Integer, ForeignKey("stores.id"))
+    size = Column(String(10), nullable=False)
+    qty = Column(Integer, nullable=False, default=0)
+    # Units held by unexpired cart reservations; qty - reserved is what can still be sold.
+    reserved = Column(Integer, nullable=False, default=0, server_default="0")
+    
+    product = relationship("Product", back_populates="stock")
+    
+    __table_args__ = (
+        Index("ux_product_stock_product_size_store", "product_id", "size", "store_id", unique=True),
+        # NULLs never collide in a unique index, so central rows need their own.
+        Index(
+            "ux_product_stock_central", "product_id", "size", unique=True,
+            sqlite_where=text("store_id IS NULL"), postgresql_where=text("store_id IS NULL")
+        ),
+    )
+
+class StockReservation(Base):
+    __tablename__ = "stock_reservations"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    store_id = Column(Integer, ForeignKey("stores.id"))
+    size = Column(String(10), nullable=False)
+    qty = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    
+    __table_args__ = (
+        Index("ix_stock_reservations_user_product_size", "user_id", "product_id", "size"),
+    )
 
 class CartItem(Base):
     __tablename__ = "cart_items"
@@ -124,12 +261,78 @@ class ReturnRequest(Base):
     status = Column(String(50), default="pending")
     created_at = Column(DateTime, default=datetime.utcnow)
 
-def get_db():
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_sync_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+def pool_status(pool) -> dict:
+    status = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(0, pool.overflow()),
+            "timeout": pool.timeout(),
+        })
+    if isinstance(pool, TimedPoolMixin):
+        status["wait_time"] = pool.wait_histogram.snapshot()
+    return status
+
+def get_pool_metrics() -> dict:
+    return {
+        "async": pool_status(async_engine.sync_engine.pool),
+        "sync": pool_status(engine.pool),
+        "settings": {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": DB_POOL_PRE_PING,
+        },
+    }
+
+LEGACY_STOCK_COLUMNS = {"S": "stock_s", "M": "stock_m", "L": "stock_l", "XL": "stock_xl"}
+
+def migrate_legacy_stock():
+    """Copies the old products.stock_<size> columns into product_stock once."""
+    columns = {c["name"] for c in inspect(engine).get_columns("products")}
+    legacy = {size: column for size, column in LEGACY_STOCK_COLUMNS.items() if column in columns}
+    if not legacy:
+        return
+    migrated = 0
+    with engine.begin() as conn:
+        for size, column in legacy.items():
+            # ON CONFLICT makes concurrent or repeated startups a no-op; SQLite needs the WHERE to parse it.
+            migrated += conn.execute(
+                text(
+                    f"INSERT INTO product_stock (product_id, size, qty) "
+                    f"SELECT id, :size, COALESCE({column}, 0) FROM products WHERE true "
+                    f"ON CONFLICT DO NOTHING"
+                ),
+                {"size": size},
+            ).rowcount
+    if migrated:
+        print(f"Migrated stock for sizes {', '.join(legacy)} into product_stock")
+
+def migrate_stock_reserved():
+    columns = {c["name"] for c in inspect(engine).get_columns("product_stock")}
+    if "reserved" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE product_stock ADD COLUMN reserved INTEGER NOT NULL DEFAULT 0"))
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all skips indexes on tables that already exist, so add any new ones explicitly.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    migrate_legacy_stock()
+    migrate_stock_reserved()
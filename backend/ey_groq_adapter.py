@@ -1,6 +1,15 @@
+import os
 import re
 import json
+import math
+import time
+import queue
+import hashlib
+import itertools
+import tempfile
 import threading
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import Future
 from typing import List, Tuple, Dict, Any, Optional
 from datetime import datetime
 
@@ -13,31 +22,108 @@ except Exception:
     SentenceTransformer = None
     faiss = None
 
-_lock = threading.RLock()
+try:
+    import fcntl
+except ImportError:
+    # No cross-process file locks (Windows); saves from one process only.
+    fcntl = None
+
+from cache import TTLCache
+from retrieval import BM25Index, reciprocal_rank_fusion
+
+LOCK_STRIPES = int(os.environ.get("ADAPTER_LOCK_STRIPES", 64))
+
+class StripedLock:
+    """A fixed pool of locks, each key always mapping to the same one.
+
+    Work on different keys almost never shares a lock, while the pool stays
+    the same size however many sessions or SKUs exist.
+    """
+
+    def __init__(self, stripes: int = LOCK_STRIPES):
+        self._locks = [threading.RLock() for _ in range(max(1, stripes))]
+
+    def __call__(self, key) -> threading.RLock:
+        return self._locks[hash(key) % len(self._locks)]
+
+    @contextmanager
+    def all(self):
+        # Always taken in pool order, so two callers cannot deadlock.
+        with ExitStack() as stack:
+            for lock in self._locks:
+                stack.enter_context(lock)
+            yield
+
 session_store: Dict[str, Dict[str, Any]] = {}
+# Keyed by session id; guards a session's history and cart.
+session_locks = StripedLock()
+# inventory_store[pid][size] only ever has a whole int replaced, so readers
+# need no lock; writers hold inventory_locks((pid, size)).
 inventory_store: Dict[str, Dict[str, int]] = {
     "p01": {"M": 5, "L": 3},
     "p02": {"M": 2, "L": 2},
     "p03": {"M": 4, "L": 0},
 }
+inventory_locks = StripedLock()
 ORDER_STORE: List[Dict[str, Any]] = []
+_order_ids = itertools.count(1)
 
 ORDINALS = {"first": 1, "second": 2, "third": 3}
 PRONOUNS = {"it", "that", "this", "those", "these", "them", "itself"}
 COLOR_WORDS = ["black", "white", "blue", "red"]
 
 products = [
-    {"pid": "p01", "title": "Black Cotton Shirt", "desc": "Men's black cotton shirt", "price": 1299},
-    {"pid": "p02", "title": "Blue Denim Shirt", "desc": "Casual blue denim shirt", "price": 1899},
-    {"pid": "p03", "title": "White Linen Shirt", "desc": "Breathable linen shirt", "price": 1499},
+    {"pid": "p01", "title": "Black Cotton Shirt", "desc": "Men's black cotton shirt", "price": 1299, "category": "shirt"},
+    {"pid": "p02", "title": "Blue Denim Shirt", "desc": "Casual blue denim shirt", "price": 1899, "category": "shirt"},
+    {"pid": "p03", "title": "White Linen Shirt", "desc": "Breathable linen shirt", "price": 1499, "category": "shirt"},
 ]
-product_texts = [p["title"] + ". " + p["desc"] for p in products]
+
+def product_text(p: Dict[str, Any]) -> str:
+    return p["title"] + ". " + p["desc"]
+
+def content_hash(p: Dict[str, Any]) -> str:
+    """Changes exactly when the product's embedding would."""
+    return hashlib.sha256(product_text(p).encode("utf-8")).hexdigest()
+
+product_texts = [product_text(p) for p in products]
 product_ids = [p["pid"] for p in products]
 pid_to_prod = {p["pid"]: p for p in products}
 
+# Lexical side of faiss_search; needs no model, so it also serves as the fallback.
+_lexical = BM25Index()
+for _pid, _text in zip(product_ids, product_texts):
+    _lexical.add(_pid, _text)
+
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_INDEX_DIR = os.environ.get(
+    "EMBEDDING_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_index")
+)
+
+# flat | ivf_flat | hnsw | ivf_pq; catalogues smaller than ANN_MIN_SIZE always use flat.
+EMBEDDING_INDEX_TYPE = os.environ.get("EMBEDDING_INDEX_TYPE", "flat")
+ANN_MIN_SIZE = int(os.environ.get("ANN_MIN_SIZE", 10000))
+IVF_NLIST = int(os.environ.get("IVF_NLIST", 0))
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", 16))
+HNSW_M = int(os.environ.get("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", 200))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 64))
+# Share of an HNSW index that may be tombstones before an update rebuilds the graph.
+HNSW_MAX_TOMBSTONES = float(os.environ.get("HNSW_MAX_TOMBSTONES", 0.1))
+PQ_M = int(os.environ.get("PQ_M", 48))
+PQ_NBITS = int(os.environ.get("PQ_NBITS", 8))
+
+EMBED_MAX_BATCH = int(os.environ.get("EMBED_MAX_BATCH", 32))
+EMBED_MAX_WAIT_MS = float(os.environ.get("EMBED_MAX_WAIT_MS", 5))
+EMBED_CACHE_SIZE = int(os.environ.get("EMBED_CACHE_SIZE", 4096))
+# Candidates taken from each of the vector and BM25 rankings before fusing them.
+HYBRID_DEPTH = int(os.environ.get("HYBRID_DEPTH", 50))
+
 _embedder = None
-_index = None
-_embs_norm = None
+_embedder_lock = threading.Lock()
+# Current SearchIndex; replaced whole by sync_products() and never modified once published.
+_search = None
+# Serialises catalogue updates; searches never take it.
+_sync_lock = threading.Lock()
 
 def l2_norm(x):
     if x is None:
@@ -46,37 +132,513 @@ def l2_norm(x):
     norm[norm == 0] = 1.0
     return x / norm
 
-def init():
-    global _embedder, _index, _embs_norm
-    with _lock:
-        if _embedder is not None and _index is not None:
-            return
-        if SentenceTransformer is None or faiss is None or np is None:
+def index_spec(n: int) -> str:
+    """faiss.index_factory description for EMBEDDING_INDEX_TYPE at `n` vectors."""
+    if EMBEDDING_INDEX_TYPE == "flat" or n < ANN_MIN_SIZE:
+        return "Flat"
+    nlist = IVF_NLIST or max(1, int(4 * math.sqrt(n)))
+    if EMBEDDING_INDEX_TYPE == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if EMBEDDING_INDEX_TYPE == "hnsw":
+        return f"HNSW{HNSW_M},Flat"
+    if EMBEDDING_INDEX_TYPE == "ivf_pq":
+        return f"IVF{nlist},PQ{PQ_M}x{PQ_NBITS}"
+    raise ValueError(f"Unknown EMBEDDING_INDEX_TYPE: {EMBEDDING_INDEX_TYPE}")
+
+def index_signature(n: int) -> str:
+    """Everything a saved index depends on besides the products themselves.
+
+    Built from the configuration: an automatic IVF nlist follows the catalogue
+    size, so adding or removing products keeps the signature; changing a
+    setting or crossing ANN_MIN_SIZE changes it and forces a rebuild.
+    """
+    spec = index_spec(n)
+    if spec.startswith("IVF") and not IVF_NLIST:
+        spec = "IVFauto" + spec[spec.index(","):]
+    return f"{EMBEDDING_MODEL}|{spec}|{HNSW_EF_CONSTRUCTION if spec.startswith('HNSW') else ''}"
+
+def inner_index(index):
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+def make_index(embs_norm, ids):
+    """Builds the configured index over normalised embeddings (inner product = cosine), keyed by `ids`."""
+    spec = index_spec(embs_norm.shape[0])
+    # IVF stores ids in its lists and removes by id; Flat and HNSW need an id map.
+    prefix = "" if spec.startswith("IVF") else "IDMap2,"
+    index = faiss.index_factory(embs_norm.shape[1], prefix + spec, faiss.METRIC_INNER_PRODUCT)
+    if spec.startswith("HNSW"):
+        inner_index(index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        index.train(embs_norm)
+    index.add_with_ids(embs_norm, np.asarray(ids, dtype="int64"))
+    return tune_index(index)
+
+def tune_index(index):
+    """Applies search-time parameters, which the saved file may not carry."""
+    inner = inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = IVF_NPROBE
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+class SearchIndex:
+    """A FAISS index together with the columns aligned with its ids.
+
+    FAISS ids are slots in `slot_pids`; a removed product's slot stays None
+    until a new product reuses it. Updates build a new SearchIndex and swap it in, so a search that took
+    a reference keeps a consistent index and columns.
+    """
+
+    __slots__ = ("index", "inner", "signature", "slot_pids", "pid_to_slot", "hashes", "tombstones", "mapped", "live", "prices", "categories", "size_stock")
+
+    def __init__(self, index, signature: str, slot_pids: List[Optional[str]], hashes: Dict[str, str], tombstones=frozenset(), mapped: bool = False):
+        self.index = index
+        self.inner = inner_index(index)
+        self.signature = signature
+        self.slot_pids = slot_pids
+        self.pid_to_slot = {pid: slot for slot, pid in enumerate(slot_pids) if pid is not None}
+        self.hashes = hashes
+        # Ids still in an HNSW index whose product was changed or removed.
+        self.tombstones = frozenset(tombstones)
+        # True while `index` is memory-mapped from the saved file by load_index().
+        self.mapped = mapped
+        # Filter columns, filled by build_filter_columns().
+        self.live = None
+        self.prices = None
+        self.categories = None
+        self.size_stock: Dict[str, Any] = {}
+
+def _meta_path() -> str:
+    return os.path.join(EMBEDDING_INDEX_DIR, "products.json")
+
+@contextmanager
+def _index_dir_lock(exclusive: bool):
+    """Cross-process lock on EMBEDDING_INDEX_DIR: exclusive to save, shared to load."""
+    os.makedirs(EMBEDDING_INDEX_DIR, exist_ok=True)
+    with open(os.path.join(EMBEDDING_INDEX_DIR, "products.lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = SentenceTransformer(EMBEDDING_MODEL)
+    return _embedder
+
+class QueryEmbedder:
+    """Encodes search queries in micro-batches.
+
+    Callers block in embed() while a worker thread takes every queued query,
+    up to `max_batch`, encodes them in one model call and hands each caller
+    its row. When the previous batch held more than one query it also waits
+    up to `max_wait_ms` for more to arrive. Normalised embeddings of
+    recent queries are kept in an LRU cache.
+    """
+
+    def __init__(self, encode, max_batch: int = EMBED_MAX_BATCH, max_wait_ms: float = EMBED_MAX_WAIT_MS, cache_size: int = EMBED_CACHE_SIZE):
+        self._encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.cache = TTLCache(maxsize=cache_size, ttl=None)
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.encoded = 0
+
+    @staticmethod
+    def cache_key(query: str) -> str:
+        # Only spacing is folded: the tokenizer drops it, but case matters to cased models.
+        return " ".join(query.split())
+
+    def embed(self, query: str):
+        key = self.cache_key(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="query-embedder", daemon=True)
+                    self._worker.start()
+        future = Future()
+        self._queue.put((key, future))
+        return future.result()
+
+    def _run(self):
+        last_batch = 1
+        while True:
+            batch = [self._queue.get()]
+            # A lone caller is not held back; waiting only pays off once queries overlap.
+            deadline = time.monotonic() + (self.max_wait if last_batch > 1 else 0)
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            texts = list(dict.fromkeys(key for key, _ in batch))
+            try:
+                embs = l2_norm(np.asarray(self._encode(texts), dtype='float32'))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            last_batch = len(batch)
+            rows = dict(zip(texts, embs))
+            for text, emb in rows.items():
+                self.cache.set(text, emb)
+            self.batches += 1
+            self.encoded += len(texts)
+            for key, future in batch:
+                future.set_result(rows[key])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "encoded": self.encoded,
+            "avg_batch": round(self.encoded / self.batches, 2) if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+            "cache": self.cache.stats(),
+        }
+
+query_embedder = QueryEmbedder(lambda texts: get_embedder().encode(texts, convert_to_numpy=True))
+
+def encode_products(items: List[Dict[str, Any]]):
+    embs = get_embedder().encode([product_text(p) for p in items], convert_to_numpy=True).astype('float32')
+    return l2_norm(embs)
+
+def build_index(items: List[Dict[str, Any]]) -> SearchIndex:
+    """Encodes every product; slots follow catalogue order."""
+    index = make_index(encode_products(items), range(len(items)))
+    return SearchIndex(index, index_signature(len(items)), [p["pid"] for p in items], {p["pid"]: content_hash(p) for p in items})
+
+def _writable_copy(state: SearchIndex):
+    """An in-memory copy of `state.index` for an update to modify.
+
+    Copied from the live index rather than re-read from disk, so the diff computed
+    against `state` always lands on the same base.
+    """
+    if not state.mapped:
+        return faiss.clone_index(state.index)
+    if isinstance(state.inner, faiss.IndexIVF):
+        # Mapped IVF lists cannot be cloned: copy their contents into memory and attach
+        # them to a serialised copy of the index taken without its lists.
+        src = state.inner.invlists
+        lists = faiss.ArrayInvertedLists(state.inner.nlist, state.inner.code_size)
+        for list_no in range(state.inner.nlist):
+            size = src.list_size(list_no)
+            if size:
+                lists.add_entries(list_no, size, src.get_ids(list_no), src.get_codes(list_no))
+        index = faiss.deserialize_index(faiss.serialize_index(state.index), faiss.IO_FLAG_SKIP_IVF_DATA)
+        index.replace_invlists(lists, True)
+        lists.this.disown()
+        return tune_index(index)
+    # A clone of an IO_FLAG_MMAP_IFC index would still view the mapped pages; a serialised copy owns its data.
+    return tune_index(faiss.deserialize_index(faiss.serialize_index(state.index)))
+
+def update_index(current: SearchIndex, items: List[Dict[str, Any]]) -> Tuple[SearchIndex, int, int]:
+    """Returns a new SearchIndex for `items`, encoding only products whose content hash
+    changed, plus how many were encoded and removed. `current` is left untouched."""
+    hashes = {p["pid"]: content_hash(p) for p in items}
+    removed = [pid for pid in current.hashes if pid not in hashes]
+    changed = [p for p in items if current.hashes.get(p["pid"]) != hashes[p["pid"]]]
+    if not removed and not changed:
+        return SearchIndex(current.index, current.signature, current.slot_pids, hashes, current.tombstones, current.mapped), 0, 0
+
+    # HNSW graphs cannot drop vectors: stale ones stay as tombstones, masked out
+    # of every search, and changed products move to a new slot.
+    hnsw = isinstance(current.inner, faiss.IndexHNSW)
+    slot_pids = list(current.slot_pids)
+    stale = [current.pid_to_slot[pid] for pid in removed]
+    stale += [current.pid_to_slot[p["pid"]] for p in changed if p["pid"] in current.pid_to_slot]
+    tombstones = current.tombstones | set(stale) if hnsw else current.tombstones
+    for pid in removed:
+        slot_pids[current.pid_to_slot[pid]] = None
+    if hnsw:
+        for slot in stale:
+            slot_pids[slot] = None
+    # Lowest free slot first keeps the filter columns short.
+    free = [slot for slot, pid in enumerate(slot_pids) if pid is None and slot not in tombstones][::-1]
+    slots = []
+    for p in changed:
+        slot = None if hnsw else current.pid_to_slot.get(p["pid"])
+        if slot is None:
+            if free:
+                slot = free.pop()
+            else:
+                slot = len(slot_pids)
+                slot_pids.append(None)
+            slot_pids[slot] = p["pid"]
+        slots.append(slot)
+    embs = encode_products(changed) if changed else None
+    ids = np.asarray(slots, dtype="int64")
+
+    if hnsw and len(tombstones) > HNSW_MAX_TOMBSTONES * current.index.ntotal:
+        # Compact: rebuild the graph from the stored vectors of live products.
+        old_ids = faiss.vector_to_array(current.index.id_map)
+        keep = ~np.isin(old_ids, np.fromiter(tombstones, dtype="int64"))
+        vectors, all_ids = current.inner.reconstruct_n(0, current.index.ntotal)[keep], old_ids[keep]
+        if embs is not None:
+            vectors, all_ids = np.vstack([vectors, embs]), np.concatenate([all_ids, ids])
+        index = make_index(vectors, all_ids)
+        tombstones = frozenset()
+    else:
+        index = _writable_copy(current)
+        if stale and not hnsw:
+            index.remove_ids(np.asarray(stale, dtype="int64"))
+        if embs is not None:
+            index.add_with_ids(embs, ids)
+    return SearchIndex(index, current.signature, slot_pids, hashes, frozenset(tombstones)), len(changed), len(removed)
+
+def save_index(state: SearchIndex, items: List[Dict[str, Any]]):
+    """Saves the index with the catalogue it was built from.
+
+    Every save writes a new products-<version>.faiss, then swaps in the
+    products.json that names it. A reader sees either the old pair or the new
+    one, and the lock stops workers saving at the same time from mixing files.
+    """
+    with _index_dir_lock(exclusive=True):
+        index_name = f"products-{time.time_ns():x}.faiss"
+        index_tmp = meta_tmp = None
+        try:
+            with tempfile.NamedTemporaryFile(dir=EMBEDDING_INDEX_DIR, suffix=".tmp", delete=False) as f:
+                index_tmp = f.name
+            faiss.write_index(state.index, index_tmp)
+            os.replace(index_tmp, os.path.join(EMBEDDING_INDEX_DIR, index_name))
+            index_tmp = None
+            with tempfile.NamedTemporaryFile("w", dir=EMBEDDING_INDEX_DIR, suffix=".tmp", delete=False) as f:
+                meta_tmp = f.name
+                # json.dumps uses the C encoder; json.dump would stream through the pure-Python one.
+                f.write(json.dumps({
+                    "signature": state.signature, "index_file": index_name, "dim": state.index.d, "count": state.index.ntotal,
+                    "slots": state.slot_pids, "hashes": state.hashes, "tombstones": sorted(state.tombstones), "products": items
+                }))
+            os.replace(meta_tmp, _meta_path())
+            meta_tmp = None
+        finally:
+            for tmp in (index_tmp, meta_tmp):
+                if tmp is not None and os.path.exists(tmp):
+                    os.remove(tmp)
+        _remove_old_indexes(index_name)
+
+def _remove_old_indexes(keep: str):
+    # Called with the exclusive directory lock held, so no load is between reading products.json and opening its file.
+    for name in os.listdir(EMBEDDING_INDEX_DIR):
+        if name != keep and (name == "products.faiss" or (name.startswith("products-") and name.endswith(".faiss"))):
+            os.remove(os.path.join(EMBEDDING_INDEX_DIR, name))
+
+def load_index() -> Optional[Tuple[SearchIndex, List[Dict[str, Any]]]]:
+    """Returns the saved index, memory-mapped, and its catalogue; None if nothing usable is saved."""
+    with _index_dir_lock(exclusive=False):
+        try:
+            with open(_meta_path()) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if "slots" not in meta or "index_file" not in meta:
+            return None
+        index_path = os.path.join(EMBEDDING_INDEX_DIR, meta["index_file"])
+        if not os.path.exists(index_path):
+            return None
+        # Pages are shared by every worker that maps the same file. IO_FLAG_MMAP_IFC maps
+        # the flat vectors of Flat and HNSW indexes; IVF lists need IO_FLAG_MMAP alone.
+        index, mapped = None, True
+        for flags in (faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0), faiss.IO_FLAG_MMAP):
+            try:
+                index = faiss.read_index(index_path, flags)
+                break
+            except RuntimeError:
+                continue
+        if index is None:
+            print("Embedding index: mmap not supported, reading into memory")
+            index, mapped = faiss.read_index(index_path), False
+    if index.ntotal != meta.get("count"):
+        print(f"Embedding index: {meta['index_file']} holds {index.ntotal} vectors, metadata expects {meta.get('count')}")
+        return None
+    state = SearchIndex(
+        tune_index(index), meta["signature"], meta["slots"], meta["hashes"], meta.get("tombstones", ()), mapped=mapped
+    )
+    return state, meta["products"]
+
+def sync_products(items: List[Dict[str, Any]], stock: Optional[Dict[str, Dict[str, int]]] = None, rebuild: bool = False) -> Dict[str, Any]:
+    """Makes `items` the catalogue, re-encoding only products whose title or description changed.
+
+    The new index is built on a copy and swapped in, so searches keep running
+    on the old one meanwhile. `stock` seeds inventory for pids not seen before.
+    """
+    with _sync_lock:
+        return _sync(items, stock, rebuild, _search, products)
+
+def _sync(items, stock, rebuild: bool, current: Optional[SearchIndex], current_items) -> Dict[str, Any]:
+    # Called with _sync_lock held; `current` was built from `current_items`.
+    global products, product_texts, product_ids, pid_to_prod, _search
+    items = [dict(p) for p in items]
+    stats = {"products": len(items), "encoded": 0, "removed": 0, "rebuilt": False}
+    state = None
+    if SentenceTransformer is not None and faiss is not None and np is not None:
+        if rebuild or current is None or current.signature != index_signature(len(items)):
+            state = build_index(items)
+            stats.update(encoded=len(items), rebuilt=True)
+        else:
+            state, stats["encoded"], stats["removed"] = update_index(current, items)
+        if stats["rebuilt"] or stats["encoded"] or stats["removed"] or items != current_items:
+            save_index(state, items)
+        stats["indexed"] = state.index.ntotal
+
+    old = pid_to_prod
+    new = {p["pid"]: p for p in items}
+    # Reservations pause while the stock masks are rebuilt, so none is lost in the swap.
+    with inventory_locks.all():
+        for pid, sizes in (stock or {}).items():
+            inventory_store.setdefault(pid, dict(sizes))
+        products, product_texts, product_ids, pid_to_prod = items, [product_text(p) for p in items], list(new), new
+        if state is not None:
+            build_filter_columns(state)
+            _search = state
+    for pid in old:
+        if pid not in new:
+            _lexical.remove(pid)
+    for pid, p in new.items():
+        if pid not in old or product_text(old[pid]) != product_text(p):
+            _lexical.add(pid, product_text(p))
+    return stats
+
+def init(rebuild: bool = False):
+    """Loads the saved index and the catalogue it was built from, encoding only on first run.
+
+    The sentence-transformers model is loaded when something needs encoding, not here.
+    """
+    if SentenceTransformer is None or faiss is None or np is None:
+        return
+    with _sync_lock:
+        if _search is not None and not rebuild:
             return
-        _embedder = SentenceTransformer("all-MiniLM-L6-v2")
-        embs = _embedder.encode(product_texts, convert_to_numpy=True).astype('float32')
-        _embs_norm = l2_norm(embs)
-        dim = _embs_norm.shape[1]
-        _index = faiss.IndexFlatIP(dim)
-        _index.add(_embs_norm)
-
-def faiss_search(query: str, k: int = 5):
-    global _embedder, _index, _embs_norm
-    if _embedder is None or _index is None:
-        results = product_ids[:k]
-        scores = [float(1.0 - 0.05 * i) for i in range(len(results))]
-        return results, scores
-    q_emb = _embedder.encode([query], convert_to_numpy=True).astype('float32')
-    q_emb_norm = l2_norm(q_emb)
-    D, I = _index.search(q_emb_norm, k)
-    ranked_pids = [product_ids[idx] for idx in I[0] if idx < len(product_ids)]
-    return ranked_pids, D[0].tolist()
+        saved = None if rebuild else load_index()
+        if saved is None:
+            _sync(products, None, rebuild, None, products)
+        else:
+            _sync(saved[1], None, False, saved[0], saved[1])
+
+def build_filter_columns(state: SearchIndex):
+    """Fills the filter columns of `state`, indexed by slot; called with every inventory lock held."""
+    state.live = np.array([pid is not None for pid in state.slot_pids], dtype=bool)
+    state.prices = np.array([pid_to_prod[pid]["price"] if pid else np.nan for pid in state.slot_pids], dtype=np.float64)
+    state.categories = np.array([pid_to_prod[pid].get("category", "") if pid else "" for pid in state.slot_pids], dtype=object)
+    sizes = {size for stock in inventory_store.values() for size in stock}
+    state.size_stock = {
+        size: np.array([pid is not None and inventory_store.get(pid, {}).get(size, 0) > 0 for pid in state.slot_pids], dtype=bool)
+        for size in sizes
+    }
+
+def _update_size_stock(pid: str, size: str):
+    # Called with inventory_locks((pid, size)) held whenever inventory_store[pid][size] changes.
+    state = _search
+    slot = state.pid_to_slot.get(pid) if state is not None else None
+    if slot is None:
+        return
+    mask = state.size_stock.get(size)
+    if mask is None:
+        mask = state.size_stock.setdefault(size, np.zeros(len(state.slot_pids), dtype=bool))
+    mask[slot] = inventory_store[pid][size] > 0
+
+def product_matches(pid: str, max_price=None, min_price=None, category=None, size=None) -> bool:
+    p = pid_to_prod.get(pid, {})
+    if max_price is not None and p.get("price", 0) > max_price:
+        return False
+    if min_price is not None and p.get("price", 0) < min_price:
+        return False
+    if category is not None and p.get("category") != category:
+        return False
+    if size is not None and inventory_store.get(pid, {}).get(size, 0) <= 0:
+        return False
+    return True
+
+def filter_mask(state: SearchIndex, max_price=None, min_price=None, category=None, size=None):
+    mask = state.live.copy()
+    if max_price is not None:
+        mask &= state.prices <= max_price
+    if min_price is not None:
+        mask &= state.prices >= min_price
+    if category is not None:
+        mask &= state.categories == category
+    if size is not None:
+        stock = state.size_stock.get(size)
+        mask &= stock if stock is not None else False
+    return mask
+
+def _search_params(state: SearchIndex, selector, k: int, exhaustive: bool = False):
+    if isinstance(state.inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=state.inner.nlist if exhaustive else IVF_NPROBE)
+    if isinstance(state.inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=max(HNSW_EF_SEARCH, k))
+    return faiss.SearchParameters(sel=selector)
+
+def vector_search(query: str, k: int, filters: Dict[str, Any]) -> List[Tuple[str, float]]:
+    """Top-k (pid, inner product) among products passing the filters.
+
+    Filters, and any HNSW tombstones, become a bitmap ID selector, so FAISS
+    skips non-matching products during the scan instead of the caller
+    over-fetching and discarding them.
+    """
+    state = _search
+    q_emb_norm = query_embedder.embed(query).reshape(1, -1)
+    k = min(k, state.index.ntotal - len(state.tombstones))
+    if k == 0:
+        return []
+    if not any(v is not None for v in filters.values()) and not state.tombstones:
+        D, I = state.index.search(q_emb_norm, k)
+    else:
+        mask = filter_mask(state, **filters)
+        count = int(mask.sum())
+        if count == 0:
+            return []
+        k = min(k, count)
+        bitmap = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        D, I = state.index.search(q_emb_norm, k, params=_search_params(state, selector, k))
+        if isinstance(state.inner, faiss.IndexIVF) and (I[0] < 0).any():
+            # A narrow filter can leave the probed lists short; every list holds the exact answer.
+            D, I = state.index.search(q_emb_norm, k, params=_search_params(state, selector, k, exhaustive=True))
+    return [(state.slot_pids[idx], float(d)) for d, idx in zip(D[0], I[0]) if idx >= 0]
+
+def faiss_search(query: str, k: int = 5, max_price=None, min_price=None, category=None, size=None):
+    """Top-k products for `query` among those passing the filters.
+
+    BM25 and vector rankings are merged by reciprocal-rank fusion. Without an
+    embedding index the BM25 ranking is used alone, topped up with other
+    matching products when fewer than k share a term with the query.
+    """
+    filters = {"max_price": max_price, "min_price": min_price, "category": category, "size": size}
+    filtered = any(v is not None for v in filters.values())
+    allowed = (lambda pid: product_matches(pid, **filters)) if filtered else None
+    if _search is None:
+        ranked = _lexical.search(query, k=k, allowed=allowed)
+        if len(ranked) < k:
+            seen = {pid for pid, _ in ranked}
+            rest = [pid for pid in product_ids if pid not in seen and (allowed is None or allowed(pid))]
+            ranked += [(pid, 0.0) for pid in rest[:k - len(ranked)]]
+    else:
+        depth = max(k, HYBRID_DEPTH)
+        semantic = vector_search(query, depth, filters)
+        lexical = _lexical.search(query, k=depth, allowed=allowed)
+        ranked = reciprocal_rank_fusion([pid for pid, _ in semantic], [pid for pid, _ in lexical])[:k]
+    return [pid for pid, _ in ranked], [score for _, score in ranked]
 
 def ask_llm(system_prompt: str, user_input: str) -> str:
     user_lower = (user_input or "").lower()
-    if "under" in user_lower or "price" in user_lower:
-        return json.dumps({"query": user_input, "max_price": 1500})
-    return json.dumps({"query": user_input})
+    result = {"query": user_input}
+    if any(word in user_lower for word in ("under", "below", "less than", "price")):
+        m = re.search(r"(?:under|below|less than)\s*(?:rs\.?|₹)?\s*(\d+)", user_lower)
+        result["max_price"] = int(m.group(1)) if m else 1500
+    m = re.search(r"size\s*[:=]?\s*([xsml0-9]+)", user_lower)
+    if m and normalize_size(m.group(1)):
+        result["size"] = normalize_size(m.group(1))
+    return json.dumps(result)
 
 def normalize_size(s: str):
     if not s:
@@ -87,20 +649,24 @@ def normalize_size(s: str):
     return mapping.get(s[:3], None)
 
 def start_session(session_id: str):
-    with _lock:
+    with session_locks(session_id):
         session = {'session_id': session_id, 'history': [], 'cart': [], 'last_recs': [], 'last_query': None, 'last_mentioned': None, 'created_at': datetime.utcnow().isoformat()}
         session_store[session_id] = session
         return session
 
 def get_session(session_id: str):
-    with _lock:
+    session = session_store.get(session_id)
+    if session is not None:
+        return session
+    with session_locks(session_id):
         if session_id not in session_store:
             return start_session(session_id)
         return session_store[session_id]
 
 def add_to_history(session_id: str, role: str, text: str):
     s = get_session(session_id)
-    s['history'].append({'role': role, 'text': text, 'ts': datetime.utcnow().isoformat()})
+    with session_locks(session_id):
+        s['history'].append({'role': role, 'text': text, 'ts': datetime.utcnow().isoformat()})
 
 def resolve_reference_to_pid(user_text: str, session_id: str):
     s = get_session(session_id)
@@ -176,34 +742,38 @@ def add_to_cart_flow(session_id: str, user_id: str, user_text: str):
     if not reserved:
         return {"reply": f"Sorry, we couldn't reserve {qty} of {pid} in any size.", "actions": [], "ui": {}}
     item = {"pid": pid, "size": size, "qty": qty, "added_at": datetime.utcnow().isoformat()}
-    s["cart"].append(item)
+    with session_locks(session_id):
+        s["cart"].append(item)
     add_to_history(session_id, "assistant", f"Added {qty} x {pid} size {size} to cart")
     return {"reply": f"Added {qty} of {pid} (size {size}) to your cart.", "actions":[{"type":"add_to_cart","pid":pid,"size":size,"qty":qty}], "ui":{"title":"Added to cart","item":item}}
 
 def check_inventory(pid: str, size: str):
-    sizes = inventory_store.get(pid, {})
-    qty = sizes.get(size, 0)
+    # Lock-free: a concurrent reservation is either fully visible or not at all.
+    qty = inventory_store.get(pid, {}).get(size, 0)
     return ("yes", qty) if qty > 0 else ("no", 0)
 
 def reserve_inventory(pid: str, size: str, qty: int) -> bool:
-    with _lock:
+    with inventory_locks((pid, size)):
         sizes = inventory_store.get(pid, {})
         avail = sizes.get(size, 0)
         if avail >= qty:
-            inventory_store[pid][size] = avail - qty
+            sizes[size] = avail - qty
+            _update_size_stock(pid, size)
             return True
         return False
 
 def release_inventory(pid: str, size: str, qty: int) -> bool:
-    with _lock:
-        if pid not in inventory_store:
-            inventory_store[pid] = {}
-        inventory_store[pid][size] = inventory_store[pid].get(size, 0) + qty
+    with inventory_locks((pid, size)):
+        sizes = inventory_store.setdefault(pid, {})
+        sizes[size] = sizes.get(size, 0) + qty
+        _update_size_stock(pid, size)
         return True
 
 def checkout_flow(session_id: str, user_id: str):
     s = get_session(session_id)
-    cart = s.get("cart", [])
+    with session_locks(session_id):
+        # Taken and emptied together, so two checkouts cannot both order the same cart.
+        cart, s["cart"] = s.get("cart", []), []
     if not cart:
         return {"reply":"Your cart is empty.","actions":[]}
     total = 0
@@ -215,14 +785,12 @@ def checkout_flow(session_id: str, user_id: str):
         total += price * it["qty"]
     payment_ok = True
     if payment_ok:
-        order_id = f"ORD{len(ORDER_STORE)+1:05d}"
+        order_id = f"ORD{next(_order_ids):05d}"
         ORDER_STORE.append({"order_id":order_id,"user_id":user_id,"items":items,"total":total,"created_at":datetime.utcnow().isoformat()})
-        s["cart"] = []
         add_to_history(session_id,"assistant",f"Order {order_id} placed. Total Rs{total}")
         return {"reply":f"Payment succeeded. Order {order_id} placed.","actions":[{"type":"order","order_id":order_id}],"ui":{"title":"Order Confirmed","order_id":order_id,"total":total,"items":items}}
     for it in cart:
         release_inventory(it["pid"],it["size"],it["qty"])
-    s["cart"]=[]
     return {"reply":"Payment failed. Your cart has been restored.","actions":[]}
 
 def classify_intent(user_msg: str):
@@ -254,7 +822,12 @@ def format_product_cards(pids):
     return cards
 
 def recommendation_agent(user_message: str, top_k: int = 3):
-    recs, _ = faiss_search(user_message, k=top_k)
+    parsed = json.loads(ask_llm("Extract the product search query and any price or size constraints as JSON.", user_message))
+    recs, _ = faiss_search(
+        parsed.get("query") or user_message, k=top_k,
+        max_price=parsed.get("max_price"), min_price=parsed.get("min_price"),
+        category=parsed.get("category"), size=parsed.get("size")
+    )
     return recs
 
 def sales_agent_handle_with_memory(session_id: str, user_id: str, user_message: str):
@@ -294,7 +867,20 @@ def chat_agent(user_id: str, message: str, session_context: Dict[str, Any] = Non
     session_id = (session_context or {}).get("session_id","default")
     return sales_agent_handle_with_memory(session_id,user_id,message)
 
-try:
-    init()
-except Exception:
-    pass
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Build or update the product embedding index used by faiss_search.")
+    parser.add_argument("--force", action="store_true", help="re-encode every product instead of only changed ones")
+    args = parser.parse_args()
+    if SentenceTransformer is None or faiss is None or np is None:
+        raise SystemExit("numpy, sentence-transformers and faiss are required to build the index")
+    init(rebuild=args.force)
+    print(f"Embedding index: {_search.index.ntotal} products -> {EMBEDDING_INDEX_DIR}")
+
+if __name__ == "__main__":
+    main()
+else:
+    try:
+        init()
+    except Exception:
+        pass
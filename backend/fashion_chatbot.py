@@ -1,53 +1,301 @@
+import sys
+import time
+import asyncio
 import random
 import uuid
+from dataclasses import dataclass, field, fields
 from datetime import datetime
-from typing import Dict, Any
-
-INVENTORY = {
-    "shirts": [
-        {"name": "Formal Shirt 1", "stock": 5, "price": 1999},
-        {"name": "Formal Shirt 2", "stock": 0, "price": 1799},
-        {"name": "Formal Shirt 3", "stock": 4, "price": 2199},
-    ],
-    "pants": [
-        {"name": "Pant 1", "stock": 6, "price": 2499},
-        {"name": "Pant 2", "stock": 3, "price": 2299},
-        {"name": "Pant 3", "stock": 0, "price": 2699},
-    ],
-    "ethnic": [
-        {"name": "Ethnic Wear 1", "stock": 2, "price": 3499},
-        {"name": "Ethnic Wear 2", "stock": 5, "price": 2999},
-    ],
-    "athleisure": [
-        {"name": "Athleisure Wear 1", "stock": 7, "price": 1599},
-        {"name": "Athleisure Wear 2", "stock": 4, "price": 1799},
-    ]
-}
+from enum import Enum
+from typing import Dict, Any, List, NamedTuple, Optional, Set, Tuple, Union
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+from sqlalchemy import func, select
 
+from catalogue import catalogue, STOCK_CACHE_TTL
+from database import AsyncSessionLocal, ProductStock, DEFAULT_SIZES
+
+# Products per query when the chat index re-reads all stock in the background.
+STOCK_RESYNC_BATCH = 1000
+
+# Categories as stored in products.category.
 COMPLEMENTARY = {
-    "shirts": ["pants"],
-    "pants": ["shirts"],
+    "shirt": ["pants"],
+    "pants": ["shirt"],
     "ethnic": ["ethnic"],
     "athleisure": ["athleisure"]
 }
 
+# One shared string per valid size. Interning is limited to these and to catalogue
+# categories: interned strings are never freed, so customer text must not be interned.
+SIZES = {size: sys.intern(size) for size in DEFAULT_SIZES}
+
 def norm(text):
     return text.strip().lower()
 
+class CatalogueIndex:
+    """The chatbot's view of the products table.
+
+    Holds name -> item and category -> in-stock items so each chat turn is a
+    dict lookup rather than a scan. Built from the shared catalogue cache and
+    kept current from its change notifications: a stock change re-reads only
+    the affected products, a product edit rebuilds the index. Stock written by
+    other workers is picked up every STOCK_CACHE_TTL seconds by a background
+    task, so no chat turn waits on a full stock read.
+    """
+
+    def __init__(self):
+        self.by_id: Dict[int, Dict[str, Any]] = {}
+        self.by_name: Dict[str, Dict[str, Any]] = {}
+        self.categories: List[str] = []
+        # category -> product id -> item, only for items with stock.
+        self.in_stock: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        # With NumPy, category -> (names, prices, in-stock mask) in product id
+        # order, and product id -> its position in those arrays.
+        self.arrays: Dict[str, Tuple[List[str], Any, Any]] = {}
+        self.positions: Dict[int, int] = {}
+        self._loaded = False
+        self._generation = 0
+        self._dirty: Set[int] = set()
+        self._synced_at = 0.0
+        self._resync: Optional[asyncio.Task] = None
+        # Products changed in this process while a resync batch was being read.
+        self._changed_during_resync: Set[int] = set()
+        catalogue.subscribe(self._on_change)
+
+    def _on_change(self, product_ids: Optional[List[int]]):
+        if product_ids is None:
+            self._generation += 1
+            self._loaded = False
+        else:
+            self._dirty.update(product_ids)
+            if self._resync is not None:
+                self._changed_during_resync.update(product_ids)
+
+    def set_stock(self, product_id: int, stock: int):
+        item = self.by_id.get(product_id)
+        if item is None:
+            return
+        item["stock"] = stock
+        in_stock = self.in_stock.setdefault(item["category"], {})
+        if stock > 0:
+            in_stock[product_id] = item
+        else:
+            in_stock.pop(product_id, None)
+        if item["category"] in self.arrays:
+            self.arrays[item["category"]][2][self.positions[product_id]] = stock > 0
+
+    async def refresh(self, db):
+        now = time.monotonic()
+        if not self._loaded:
+            generation = self._generation
+            self._dirty.clear()
+            products = await catalogue.products_in_category(db)
+            levels = await catalogue.stock_levels(db, [p["id"] for p in products])
+            by_id, by_name, in_stock = {}, {}, {}
+            for product in products:
+                price = product["price"]
+                item = {
+                    "id": product["id"],
+                    "name": product["title"],
+                    "category": sys.intern(product["category"]),
+                    "price": int(price) if float(price).is_integer() else price,
+                    "stock": sum(levels.get(product["id"], {}).values())
+                }
+                by_id[item["id"]] = item
+                by_name.setdefault(norm(item["name"]), item)
+                category_stock = in_stock.setdefault(item["category"], {})
+                if item["stock"] > 0:
+                    category_stock[item["id"]] = item
+            arrays, positions = {}, {}
+            if np is not None:
+                by_category: Dict[str, List[Dict[str, Any]]] = {}
+                for item in by_id.values():
+                    positions[item["id"]] = len(by_category.setdefault(item["category"], []))
+                    by_category[item["category"]].append(item)
+                for category, items in by_category.items():
+                    arrays[category] = (
+                        [item["name"] for item in items],
+                        np.array([item["price"] for item in items], dtype=np.float64),
+                        np.array([item["stock"] > 0 for item in items], dtype=bool)
+                    )
+            self.by_id, self.by_name, self.in_stock = by_id, by_name, in_stock
+            self.arrays, self.positions = arrays, positions
+            self.categories = list(in_stock)
+            self._synced_at = now
+            self._loaded = generation == self._generation
+            return
+        
+        if now - self._synced_at >= STOCK_CACHE_TTL and self._resync is None:
+            self._synced_at = now
+            self._resync = asyncio.create_task(self._resync_stock(self._generation))
+        if self._dirty:
+            product_ids = list(self._dirty)
+            self._dirty.clear()
+            levels = await catalogue.stock_levels(db, product_ids)
+            for product_id in product_ids:
+                self.set_stock(product_id, sum(levels.get(product_id, {}).values()))
+
+    async def _resync_stock(self, generation: int):
+        """Re-reads central stock in batches of product ids and applies only the totals that changed.
+
+        Runs on its own session and yields between batches. Products changed in
+        this process meanwhile are skipped: the dirty path already re-reads them.
+        """
+        try:
+            product_ids = sorted(self.by_id)
+            async with AsyncSessionLocal() as db:
+                for start in range(0, len(product_ids), STOCK_RESYNC_BATCH):
+                    batch = product_ids[start:start + STOCK_RESYNC_BATCH]
+                    self._changed_during_resync.clear()
+                    rows = (await db.execute(
+                        select(ProductStock.product_id, func.sum(ProductStock.qty - ProductStock.reserved))
+                        .where(ProductStock.store_id.is_(None), ProductStock.product_id.between(batch[0], batch[-1]))
+                        .group_by(ProductStock.product_id)
+                    )).all()
+                    if generation != self._generation:
+                        return
+                    totals = dict(rows)
+                    for product_id in batch:
+                        if product_id in self._changed_during_resync:
+                            continue
+                        stock = int(totals.get(product_id) or 0)
+                        item = self.by_id.get(product_id)
+                        if item is not None and item["stock"] != stock:
+                            self.set_stock(product_id, stock)
+                    await asyncio.sleep(0)
+        except Exception as e:
+            print(f"Chat catalogue stock resync error: {e}")
+        finally:
+            self._changed_during_resync.clear()
+            self._resync = None
+
+    async def warm(self):
+        """Builds the index on its own session, so the first chat turn does not pay for it."""
+        try:
+            async with AsyncSessionLocal() as db:
+                await self.refresh(db)
+        except Exception as e:
+            print(f"Chat catalogue warm-up error: {e}")
+
+    def find(self, name: str) -> Optional[Dict[str, Any]]:
+        return self.by_name.get(norm(name))
+
+    def canonical_category(self, name: str) -> str:
+        """The catalogue's shared copy of `name`, or `name` itself if it is not a known category."""
+        for category in self.categories:
+            if category == name:
+                return category
+        return name
+
+    def match_category(self, text: str) -> Optional[str]:
+        for category in self.categories:
+            if category in text or category[:-1] in text:
+                return category
+        return None
+
+    def available(self, category: str) -> List[Dict[str, Any]]:
+        return list(self.in_stock.get(category, {}).values())
+
+chat_catalogue = CatalogueIndex()
+
+def category_prompt():
+    return f"What are you shopping for? ({' / '.join(chat_catalogue.categories)})"
+
+class Step(str, Enum):
+    ASK_PRODUCT = "ask_product"
+    SELECT_PRODUCT = "select_product"
+    SELECT_SIZE = "select_size"
+    CART_DECISION = "cart_decision"
+    RECOMMENDATION = "recommendation"
+    SHOP_MORE = "shop_more"
+    APPLY_OFFER = "apply_offer"
+    PAYMENT = "payment"
+    SUPPORT = "support"
+    CSAT = "csat"
+    END = "end"
+
+class CartLine(NamedTuple):
+    product: str
+    size: str
+    price: int
+
+@dataclass(slots=True)
+class ChatState:
+    """One chat session. Slots and shared Step members keep a live session small.
+
+    Item access (`state["response"]`) still works for callers written against
+    the old dict state.
+    """
+    user_input: str = ""
+    step: Step = Step.ASK_PRODUCT
+    category: str = ""
+    product: str = ""
+    size: str = ""
+    cart: List[CartLine] = field(default_factory=list)
+    cart_total: int = 0
+    discount: int = 0
+    final_price: int = 0
+    payment_attempts: int = 0
+    recommended_items: Tuple[str, ...] = ()
+    response: str = ""
+    price: int = 0
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in STATE_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key not in STATE_FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {name: getattr(self, name) for name in STATE_FIELDS}
+        data["step"] = self.step.value
+        data["cart"] = [line._asdict() for line in self.cart]
+        data["recommended_items"] = list(self.recommended_items)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ChatState":
+        values = {name: data[name] for name in STATE_FIELDS if name in data}
+        if "step" in values:
+            values["step"] = Step(values["step"])
+        if "category" in values:
+            values["category"] = chat_catalogue.canonical_category(values["category"])
+        if "size" in values:
+            values["size"] = SIZES.get(values["size"], values["size"])
+        if "cart" in values:
+            values["cart"] = [
+                CartLine(**line) if isinstance(line, dict) else CartLine(*line)
+                for line in values["cart"]
+            ]
+        if "recommended_items" in values:
+            values["recommended_items"] = tuple(values["recommended_items"])
+        return cls(**values)
+
+STATE_FIELDS = frozenset(f.name for f in fields(ChatState))
+
 def available_products(category):
-    return [i["name"] for i in INVENTORY[category] if i["stock"] > 0]
+    return [item["name"] for item in chat_catalogue.available(category)]
 
 def smart_recommend(category, cart, top_k=2):
-    cart_products = {item["product"] for item in cart}
-    cart_prices = [item["price"] for item in cart]
+    cart_products = {item.product for item in cart}
+    cart_prices = [item.price for item in cart]
     avg_price = sum(cart_prices) / len(cart_prices) if cart_prices else 2000
 
+    if chat_catalogue.arrays:
+        return _rank_by_price(category, cart_products, avg_price, top_k)
+
     candidates = []
 
     for cat in COMPLEMENTARY.get(category, []):
-        for item in INVENTORY.get(cat, []):
-            if item["stock"] <= 0:
-                continue
+        for item in chat_catalogue.available(cat):
             if item["name"] in cart_products:
                 continue
 
@@ -63,13 +311,47 @@ def smart_recommend(category, cart, top_k=2):
     candidates.sort(key=lambda x: x["score"], reverse=True)
     return [c["product"] for c in candidates[:top_k]]
 
+def _rank_by_price(category, cart_products, avg_price, top_k):
+    """NumPy version of the loop in smart_recommend, with the same ordering.
+
+    1 / (1 + diff) falls as diff grows, so ranking by the smallest price
+    difference is ranking by the highest score.
+    """
+    names, prices, masks = [], [], []
+    for cat in COMPLEMENTARY.get(category, []):
+        if cat not in chat_catalogue.arrays:
+            continue
+        cat_names, cat_prices, cat_in_stock = chat_catalogue.arrays[cat]
+        mask = cat_in_stock.copy()
+        for product in cart_products:
+            item = chat_catalogue.find(product)
+            if item and item["category"] == cat and item["name"] == product:
+                mask[chat_catalogue.positions[item["id"]]] = False
+        names.extend(cat_names)
+        prices.append(cat_prices)
+        masks.append(mask)
+    if not names:
+        return []
+
+    prices = np.concatenate(prices)
+    candidates = np.flatnonzero(np.concatenate(masks))
+    if candidates.size == 0:
+        return []
+    diff = np.abs(prices[candidates] - avg_price)
+    k = min(top_k, candidates.size)
+    # Keep every candidate tied with the k-th best so ties resolve in catalogue order, as the stable sort did.
+    kth = diff[np.argpartition(diff, k - 1)[k - 1]]
+    top = np.flatnonzero(diff <= kth)
+    top = top[np.argsort(diff[top], kind="stable")][:k]
+    return [names[candidates[i]] for i in top]
+
 def generate_invoice(state):
     invoice_id = str(uuid.uuid4())[:8]
     date = datetime.now().strftime("%d-%m-%Y %H:%M")
 
     items = "\n".join(
-        [f"{i+1}. {item['product']} (Size {item['size']}) - ₹{item['price']}"
-         for i, item in enumerate(state["cart"])]
+        [f"{i+1}. {item.product} (Size {item.size}) - ₹{item.price}"
+         for i, item in enumerate(state.cart)]
     )
 
     invoice_text = f"""
@@ -83,9 +365,9 @@ Items Purchased:
 {items}
 
 ------------------------------
-Subtotal      : ₹{state['cart_total']}
-Discount      : ₹{state['discount']}
-Final Amount  : ₹{state['final_price']}
+Subtotal      : ₹{state.cart_total}
+Discount      : ₹{state.discount}
+Final Amount  : ₹{state.final_price}
 ------------------------------
 
 Thank you for shopping with us!
@@ -95,134 +377,130 @@ Thank you for shopping with us!
     return invoice_text, filename
 
 def ask_product(state):
-    text = norm(state["user_input"])
-    for cat in INVENTORY:
-        if cat in text or cat[:-1] in text:
-            state["category"] = cat
-            state["response"] = (
-                f"Available {cat}:\n" +
-                ", ".join(available_products(cat)) +
-                "\n\nWhich one would you like?"
-            )
-            state["step"] = "select_product"
-            return state
+    cat = chat_catalogue.match_category(norm(state.user_input))
+    if cat:
+        state.category = cat
+        state.response = (
+            f"Available {cat}:\n" +
+            ", ".join(available_products(cat)) +
+            "\n\nWhich one would you like?"
+        )
+        state.step = Step.SELECT_PRODUCT
+        return state
 
-    state["response"] = "What are you shopping for? (shirts / pants / ethnic / athleisure)"
+    state.response = category_prompt()
     return state
 
 def select_product(state):
-    state["product"] = state["user_input"]
-    state["price"] = next(
-        (i["price"] for i in INVENTORY[state["category"]] if i["name"] == state["product"]),
-        random.choice([1499, 1999, 2499])
-    )
-    state["response"] = "Select size: S / M / L / XL"
-    state["step"] = "select_size"
+    item = chat_catalogue.find(state.user_input)
+    if item and item["category"] == state.category:
+        state.product = item["name"]
+        state.price = item["price"]
+    else:
+        state.product = state.user_input
+        state.price = random.choice([1499, 1999, 2499])
+    state.response = "Select size: S / M / L / XL"
+    state.step = Step.SELECT_SIZE
     return state
 
 def select_size(state):
-    state["size"] = state["user_input"].upper()
-    state["response"] = "Add to cart? (yes / no)"
-    state["step"] = "cart_decision"
+    size = state.user_input.upper()
+    state.size = SIZES.get(size, size)
+    state.response = "Add to cart? (yes / no)"
+    state.step = Step.CART_DECISION
     return state
 
 def cart_decision(state):
-    if norm(state["user_input"]) == "yes":
-        state["cart"].append({
-            "product": state["product"],
-            "size": state["size"],
-            "price": state["price"]
-        })
-        state["cart_total"] += state["price"]
-
-        recs = smart_recommend(state["category"], state["cart"])
+    if norm(state.user_input) == "yes":
+        state.cart.append(CartLine(state.product, state.size, state.price))
+        state.cart_total += state.price
+
+        recs = smart_recommend(state.category, state.cart)
         if recs:
-            state["recommended_items"] = recs
-            state["response"] = (
+            state.recommended_items = tuple(recs)
+            state.response = (
                 "Item added to cart 🛒\n\n"
                 "Recommended for you:\n" +
                 ", ".join(recs) +
                 "\n\nAdd a recommended item? (yes / no)"
             )
-            state["step"] = "recommendation"
+            state.step = Step.RECOMMENDATION
             return state
 
-        state["response"] = "Item added to cart 🛒\nShop more? (yes / no)"
-        state["step"] = "shop_more"
+        state.response = "Item added to cart 🛒\nShop more? (yes / no)"
+        state.step = Step.SHOP_MORE
         return state
 
-    state["response"] = "Okay 🙂 What else would you like to shop for?"
-    state["step"] = "ask_product"
+    state.response = "Okay 🙂 What else would you like to shop for?"
+    state.step = Step.ASK_PRODUCT
     return state
 
 def recommendation(state):
-    if norm(state["user_input"]) == "yes" and state["recommended_items"]:
-        item = state["recommended_items"][0]
-        price = next(
-            (i["price"] for cat in INVENTORY for i in INVENTORY[cat] if i["name"] == item),
-            999
-        )
-        state["cart"].append({"product": item, "size": "M", "price": price})
-        state["cart_total"] += price
-        state["response"] = f"{item} added 👍\nShop more? (yes / no)"
+    if norm(state.user_input) == "yes" and state.recommended_items:
+        item = state.recommended_items[0]
+        match = chat_catalogue.find(item)
+        price = match["price"] if match else 999
+        state.cart.append(CartLine(item, "M", price))
+        state.cart_total += price
+        state.response = f"{item} added 👍\nShop more? (yes / no)"
     else:
-        state["response"] = "No problem 🙂 Shop more? (yes / no)"
+        state.response = "No problem 🙂 Shop more? (yes / no)"
 
-    state["step"] = "shop_more"
+    state.step = Step.SHOP_MORE
     return state
 
 def shop_more(state):
-    if norm(state["user_input"]) == "yes":
-        state["step"] = "ask_product"
-        state["response"] = "What would you like next?"
+    if norm(state.user_input) == "yes":
+        state.step = Step.ASK_PRODUCT
+        state.response = "What would you like next?"
         return state
 
-    summary = "\n".join([f"{i['product']} – ₹{i['price']}" for i in state["cart"]])
-    state["response"] = (
+    summary = "\n".join([f"{i.product} – ₹{i.price}" for i in state.cart])
+    state.response = (
         "🛒 CART SUMMARY:\n" + summary +
-        f"\n\nSubtotal: ₹{state['cart_total']}\n\n"
+        f"\n\nSubtotal: ₹{state.cart_total}\n\n"
         "Offers:\n1) HDFC ₹300\n2) ICICI ₹250\n3) SBI ₹200\nChoose offer:"
     )
-    state["step"] = "apply_offer"
+    state.step = Step.APPLY_OFFER
     return state
 
 def apply_offer(state):
     offers = {"1": 300, "2": 250, "3": 200}
-    state["discount"] = offers.get(state["user_input"], 0)
-    state["final_price"] = state["cart_total"] - state["discount"]
-    state["response"] = f"Final amount: ₹{state['final_price']}\nBuy online or store?"
-    state["step"] = "payment"
+    state.discount = offers.get(state.user_input, 0)
+    state.final_price = state.cart_total - state.discount
+    state.response = f"Final amount: ₹{state.final_price}\nBuy online or store?"
+    state.step = Step.PAYMENT
     return state
 
 def payment(state):
-    choice = state["user_input"].lower()
+    choice = state.user_input.lower()
 
     if choice == "store":
-        state["response"] = "Please complete payment at the nearest store."
-        state["step"] = "support"
+        state.response = "Please complete payment at the nearest store."
+        state.step = Step.SUPPORT
         return state
 
-    state["payment_attempts"] += 1
+    state.payment_attempts += 1
     success = random.random() < 0.7
 
     if success:
-        state["response"] = "✅ Payment successful! Delivery in 3–5 days."
-        state["step"] = "support"
+        state.response = "✅ Payment successful! Delivery in 3–5 days."
+        state.step = Step.SUPPORT
         return state
 
-    if state["payment_attempts"] == 1:
-        state["response"] = "❌ Payment failed. Retry? (yes / no)"
-        state["step"] = "payment"
+    if state.payment_attempts == 1:
+        state.response = "❌ Payment failed. Retry? (yes / no)"
+        state.step = Step.PAYMENT
         return state
 
-    state["response"] = "❌ Payment failed twice. Please pay at store."
-    state["step"] = "support"
+    state.response = "❌ Payment failed twice. Please pay at store."
+    state.step = Step.SUPPORT
     return state
 
 def support(state):
     invoice_text, filename = generate_invoice(state)
 
-    state["response"] = (
+    state.response = (
         "✅ Order completed successfully!\n\n"
         "🧾 INVOICE:\n"
         f"{invoice_text}\n"
@@ -230,48 +508,38 @@ def support(state):
         "⭐ Please rate your experience (1–5):"
     )
 
-    state["step"] = "csat"
+    state.step = Step.CSAT
     return state
 
 def csat(state):
-    rating = state["user_input"]
-    state["response"] = f"Thank you for your {rating}-star rating! Have a great day!"
-    state["step"] = "end"
+    rating = state.user_input
+    state.response = f"Thank you for your {rating}-star rating! Have a great day!"
+    state.step = Step.END
     return state
 
 NODE_MAP = {
-    "ask_product": ask_product,
-    "select_product": select_product,
-    "select_size": select_size,
-    "cart_decision": cart_decision,
-    "recommendation": recommendation,
-    "shop_more": shop_more,
-    "apply_offer": apply_offer,
-    "payment": payment,
-    "support": support,
-    "csat": csat
+    Step.ASK_PRODUCT: ask_product,
+    Step.SELECT_PRODUCT: select_product,
+    Step.SELECT_SIZE: select_size,
+    Step.CART_DECISION: cart_decision,
+    Step.RECOMMENDATION: recommendation,
+    Step.SHOP_MORE: shop_more,
+    Step.APPLY_OFFER: apply_offer,
+    Step.PAYMENT: payment,
+    Step.SUPPORT: support,
+    Step.CSAT: csat
 }
 
-def create_initial_state() -> Dict[str, Any]:
-    return {
-        "user_input": "",
-        "step": "ask_product",
-        "category": "",
-        "product": "",
-        "size": "",
-        "cart": [],
-        "cart_total": 0,
-        "discount": 0,
-        "final_price": 0,
-        "payment_attempts": 0,
-        "recommended_items": [],
-        "response": "",
-        "price": 0
-    }
-
-def process_message(state: Dict[str, Any], user_input: str) -> Dict[str, Any]:
-    state["user_input"] = user_input
-    current_step = state["step"]
+def create_initial_state() -> ChatState:
+    return ChatState()
+
+def process_message(state: Union[ChatState, Dict[str, Any]], user_input: str) -> ChatState:
+    """Runs one turn. A dict state (as stored before ChatState, or read back from
+    a shared session store) is converted first."""
+    if isinstance(state, dict):
+        state = ChatState.from_dict(state)
+    state.user_input = user_input
+    current_step = state.step
     
     if current_step in NODE_MAP:
         state = NODE_MAP[current_step](state)
@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from cache import TTLCache
+
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 3600))
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", 4096))
+# SQLite file for the second tier; unset keeps the cache in memory only.
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH") or None
+
+def normalise_prompt(text: str) -> str:
+    """Collapses whitespace so prompts differing only in spacing share a cache entry.
+
+    Everything else, numbers included, is kept: prompts that should share an
+    answer across amounts name placeholders instead and fill them in after the
+    lookup (see ai_generate_response).
+    """
+    return " ".join(text.split())
+
+
+class PromptCache:
+    """Completions keyed by (model, system prompt, normalised prompt).
+
+    Lookups go memory LRU -> optional SQLite file -> model. Concurrent misses
+    for the same key share one model call instead of each starting their own.
+    """
+
+    def __init__(self, maxsize: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL, path: Optional[str] = LLM_CACHE_PATH):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.disk_hits = 0
+        self.shared = 0
+        self.llm_calls = 0
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        with self._disk_lock:
+            row = self._db().execute("SELECT response, expires_at FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= time.time():
+                self._conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return row[0]
+
+    def _disk_set(self, key: str, value: str):
+        with self._disk_lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO llm_responses (key, response, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + self.ttl)
+            )
+            self._conn.commit()
+
+    async def get_or_create(self, key: str, create: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+
+        if self.path:
+            try:
+                value = await asyncio.to_thread(self._disk_get, key)
+            except sqlite3.Error as e:
+                print(f"LLM cache error: {e}")
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+                return value
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.shared += 1
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            self.llm_calls += 1
+            value = await create()
+            # Failures and timeouts come back as None and are not cached.
+            if value is not None:
+                self.memory.set(key, value)
+                if self.path:
+                    try:
+                        await asyncio.to_thread(self._disk_set, key, value)
+                    except sqlite3.Error as e:
+                        print(f"LLM cache error: {e}")
+        finally:
+            del self._inflight[key]
+            future.set_result(value)
+        return value
+
+    def clear(self):
+        self.memory.clear()
+        if self.path:
+            with self._disk_lock:
+                self._db().execute("DELETE FROM llm_responses")
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory.hits + self.memory.misses
+        hits = self.memory.hits + self.disk_hits + self.shared
+        return {
+            "memory": self.memory.stats(),
+            "disk": self.path,
+            "disk_hits": self.disk_hits,
+            "shared_inflight": self.shared,
+            "llm_calls": self.llm_calls,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+llm_cache = PromptCache()
@@ -0,0 +1,186 @@
+import re
+import math
+import heapq
+import bisect
+import itertools
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Standard damping constant for reciprocal-rank fusion.
+RRF_K = 60
+# Query terms at least this long that match no indexed term are read as prefixes ("shi" -> "shirt").
+PREFIX_MIN_LEN = 3
+# Caps how many indexed terms one prefix expands to.
+PREFIX_MAX_EXPANSIONS = 50
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN.findall((text or "").lower()):
+        # Plural folding so "shirts" finds "shirt"; "dress" keeps its ss.
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """In-process inverted index scored with Okapi BM25.
+
+    Documents can be added, replaced and removed one at a time; only the
+    postings of the terms involved change. A query term found in no document
+    matches every indexed term it is a prefix of, so partly typed words still
+    find products.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        self._doc_terms: Dict[Hashable, Dict[str, int]] = {}
+        self._doc_len: Dict[Hashable, int] = {}
+        # Every term with postings, sorted for prefix lookups; rebuilt on first use after the vocabulary changes.
+        self._terms: Optional[List[str]] = None
+        self._total_len = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def __contains__(self, doc_id: Hashable) -> bool:
+        return doc_id in self._doc_terms
+
+    def _remove(self, doc_id: Hashable):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_len -= self._doc_len.pop(doc_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+                self._terms = None
+
+    def add(self, doc_id: Hashable, text: str):
+        terms: Dict[str, int] = {}
+        for token in tokenize(text):
+            terms[token] = terms.get(token, 0) + 1
+        with self._lock:
+            self._remove(doc_id)
+            self._doc_terms[doc_id] = terms
+            self._doc_len[doc_id] = sum(terms.values())
+            self._total_len += self._doc_len[doc_id]
+            for term, tf in terms.items():
+                if term not in self._postings:
+                    self._postings[term] = {}
+                    self._terms = None
+                self._postings[term][doc_id] = tf
+
+    def remove(self, doc_id: Hashable):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _query_terms(self, query: str) -> Set[str]:
+        # Called with the lock held.
+        terms = set()
+        for token in set(tokenize(query)):
+            if token in self._postings:
+                terms.add(token)
+            elif len(token) >= PREFIX_MIN_LEN:
+                if self._terms is None:
+                    self._terms = sorted(self._postings)
+                start = bisect.bisect_left(self._terms, token)
+                for term in itertools.takewhile(lambda t: t.startswith(token), self._terms[start:start + PREFIX_MAX_EXPANSIONS]):
+                    terms.add(term)
+        return terms
+
+    def search(self, query: str, k: Optional[int] = None, allowed: Optional[Callable[[Hashable], bool]] = None) -> List[Tuple[Hashable, float]]:
+        """Documents sharing a term with `query`, best first; all of them when `k` is None."""
+        with self._lock:
+            n = len(self._doc_terms)
+            if not n:
+                return []
+            avg_len = self._total_len / n or 1.0
+            scores: Dict[Hashable, float] = {}
+            for term in self._query_terms(query):
+                postings = self._postings[term]
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    if allowed is not None and not allowed(doc_id):
+                        continue
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        if k is None:
+            return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(*rankings: Iterable[Hashable], k: int = RRF_K) -> List[Tuple[Hashable, float]]:
+    """Merges ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in."""
+    fused: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def product_text(product: Dict[str, Any]) -> str:
+    return f"{product['title']} {product.get('description') or ''}"
+
+
+class ProductRetriever:
+    """BM25 over products.title and description, kept in step with a CatalogueCache.
+
+    After a commit adds or edits products the next search re-reads the
+    catalogue snapshot and re-indexes only products whose text changed.
+    """
+
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+        self.index = BM25Index()
+        self._hashes: Dict[int, str] = {}
+        self._categories: Dict[int, str] = {}
+        self._stale = True
+        catalogue.subscribe(self._on_change)
+
+    def _on_change(self, product_ids: Optional[List[int]]):
+        if product_ids is None:
+            self._stale = True
+
+    def sync(self, products: Iterable[Dict[str, Any]]) -> int:
+        """Brings the index in line with `products`; returns how many were (re)indexed or removed."""
+        seen = set()
+        changed = 0
+        for product in products:
+            product_id = product["id"]
+            seen.add(product_id)
+            self._categories[product_id] = product["category"]
+            text = product_text(product)
+            digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+            if self._hashes.get(product_id) != digest:
+                self.index.add(product_id, text)
+                self._hashes[product_id] = digest
+                changed += 1
+        for product_id in [pid for pid in self._hashes if pid not in seen]:
+            self.index.remove(product_id)
+            del self._hashes[product_id]
+            self._categories.pop(product_id, None)
+            changed += 1
+        return changed
+
+    async def refresh(self, db):
+        if self._stale:
+            # Cleared first: a change committed while loading marks it stale again.
+            self._stale = False
+            self.sync(await self.catalogue.products_in_category(db))
+
+    async def search(self, db, query: str, k: Optional[int] = None, category: Optional[str] = None) -> List[Tuple[int, float]]:
+        await self.refresh(db)
+        allowed = (lambda product_id: self._categories.get(product_id) == category) if category else None
+        return self.index.search(query, k=k, allowed=allowed)
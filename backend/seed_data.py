@@ -1,5 +1,7 @@
-from database import SessionLocal, Store, Product, BankOffer, init_db
+from database import SessionLocal, Store, Product, ProductStock, BankOffer, DEFAULT_SIZES, init_db
+from sqlalchemy.orm import selectinload
 import random
+import ey_groq_adapter
 
 def seed_stores():
     db = SessionLocal()
@@ -219,10 +221,7 @@ def seed_products():
                     description=desc,
                     category=category,
                     price=price,
-                    stock_s=random.randint(5, 25),
-                    stock_m=random.randint(5, 25),
-                    stock_l=random.randint(5, 25),
-                    stock_xl=random.randint(5, 25),
+                    stock=[ProductStock(size=size, qty=random.randint(5, 25)) for size in DEFAULT_SIZES],
                 )
                 db.add(product)
                 pid_counter += 1
@@ -256,11 +255,36 @@ def seed_bank_offers():
     finally:
         db.close()
 
+def sync_embedding_index(rebuild=False):
+    """Points the chat adapter's product search at the products table.
+
+    Only products whose title or description changed since the last sync are
+    re-embedded; searches keep running while the index is updated.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.query(Product).options(selectinload(Product.stock)).order_by(Product.id).all()
+        items = [
+            {"pid": p.pid, "title": p.title, "desc": p.description or "", "price": p.price, "category": p.category}
+            for p in rows
+        ]
+        stock = {
+            p.pid: {s.size: s.qty - s.reserved for s in p.stock if s.store_id is None}
+            for p in rows
+        }
+    finally:
+        db.close()
+    
+    stats = ey_groq_adapter.sync_products(items, stock=stock, rebuild=rebuild)
+    print(f"Embedding index synced: {stats['encoded']} encoded, {stats['removed']} removed, {stats['products']} products")
+    return stats
+
 def seed_all():
     init_db()
     seed_stores()
     seed_products()
     seed_bank_offers()
+    sync_embedding_index()
     print("All data seeded successfully!")
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import redis.asyncio as aioredis
+except Exception:
+    aioredis = None
+
+CHAT_SESSION_BACKEND = os.environ.get("CHAT_SESSION_BACKEND", "memory")
+CHAT_SESSION_MAX = int(os.environ.get("CHAT_SESSION_MAX", 10000))
+CHAT_SESSION_MAX_BYTES = int(os.environ.get("CHAT_SESSION_MAX_BYTES", 64 * 1024 * 1024))
+CHAT_SESSION_IDLE_TTL = int(os.environ.get("CHAT_SESSION_IDLE_TTL", 1800))
+CHAT_SESSION_REDIS_URL = os.environ.get("CHAT_SESSION_REDIS_URL", "redis://localhost:6379/0")
+
+
+def dump_state(state: Any) -> str:
+    if hasattr(state, "to_dict"):
+        state = state.to_dict()
+    return json.dumps(state, separators=(",", ":"), ensure_ascii=False)
+
+
+class MemorySessionStore:
+    """Per-process chat sessions, evicted least recently used first.
+
+    A session expires after `idle_ttl` seconds without a get or set. The store
+    holds at most `max_sessions` sessions and, when `max_bytes` is non-zero,
+    at most that many bytes of serialised state.
+    """
+
+    backend = "memory"
+
+    def __init__(self, max_sessions: int = CHAT_SESSION_MAX, idle_ttl: float = CHAT_SESSION_IDLE_TTL, max_bytes: int = CHAT_SESSION_MAX_BYTES):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        # session id -> (state, last seen, serialised size), oldest activity first.
+        self._data: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.expired = 0
+
+    def _drop(self, session_id: str):
+        _, _, size = self._data.pop(session_id)
+        self._bytes -= size
+
+    def _expire(self, now: float):
+        # Entries are in activity order, so expired ones are all at the front.
+        while self._data:
+            session_id, (_, last_seen, _) = next(iter(self._data.items()))
+            if now - last_seen < self.idle_ttl:
+                break
+            self._drop(session_id)
+            self.expired += 1
+
+    async def get(self, session_id: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._data.get(session_id)
+            if entry is None:
+                return None
+            self._data[session_id] = (entry[0], now, entry[2])
+            self._data.move_to_end(session_id)
+            return entry[0]
+
+    async def set(self, session_id: str, state: Any):
+        size = len(dump_state(state).encode("utf-8"))
+        now = time.monotonic()
+        with self._lock:
+            if session_id in self._data:
+                self._drop(session_id)
+            self._data[session_id] = (state, now, size)
+            self._bytes += size
+            self._expire(now)
+            while len(self._data) > 1 and (
+                len(self._data) > self.max_sessions or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                self._drop(next(iter(self._data)))
+                self.evicted += 1
+
+    async def delete(self, session_id: str):
+        with self._lock:
+            if session_id in self._data:
+                self._drop(session_id)
+
+    async def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "backend": self.backend,
+                "sessions": len(self._data),
+                "bytes": self._bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "idle_ttl": self.idle_ttl,
+                "evicted": self.evicted,
+                "expired": self.expired,
+            }
+
+    async def close(self):
+        pass
+
+
+class RedisSessionStore:
+    """Chat sessions in Redis or a compatible server, shared by every worker.
+
+    Each session is one key that expires after `idle_ttl` seconds without
+    activity. Size limits belong to the server: run it with `maxmemory` and
+    `maxmemory-policy allkeys-lru` (or volatile-lru) for LRU eviction.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str = CHAT_SESSION_REDIS_URL, idle_ttl: int = CHAT_SESSION_IDLE_TTL, prefix: str = "chat:session:"):
+        self.client = aioredis.from_url(url, decode_responses=True)
+        self.idle_ttl = idle_ttl
+        self.prefix = prefix
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        key = self.prefix + session_id
+        async with self.client.pipeline(transaction=False) as pipe:
+            raw, _ = await pipe.get(key).expire(key, self.idle_ttl).execute()
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, session_id: str, state: Any):
+        await self.client.set(self.prefix + session_id, dump_state(state), ex=self.idle_ttl)
+
+    async def delete(self, session_id: str):
+        await self.client.delete(self.prefix + session_id)
+
+    async def stats(self) -> Dict[str, Any]:
+        memory = await self.client.info("memory")
+        # The database may hold other keys, so count only this store's; SCAN does not block the server.
+        sessions = 0
+        async for _ in self.client.scan_iter(match=self.prefix + "*", count=1000):
+            sessions += 1
+        return {
+            "backend": self.backend,
+            "sessions": sessions,
+            "used_memory": memory.get("used_memory"),
+            "maxmemory": memory.get("maxmemory"),
+            "maxmemory_policy": memory.get("maxmemory_policy"),
+            "idle_ttl": self.idle_ttl,
+        }
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_session_store():
+    if CHAT_SESSION_BACKEND == "redis":
+        if aioredis is not None:
+            return RedisSessionStore()
+        print("Chat session store: redis package not installed, using in-process store")
+    return MemorySessionStore()
@@ -0,0 +1,112 @@
+import os
+import asyncio
+import itertools
+import random
+import tempfile
+from datetime import timedelta
+
+import pytest
+
+# database.py and the agents read their settings at import time.
+_tmpdir = tempfile.mkdtemp(prefix="shop-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'shop.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["EMBEDDING_INDEX_DIR"] = os.path.join(_tmpdir, "embeddings")
+os.environ["CHAT_SESSION_BACKEND"] = "memory"
+os.environ.pop("OPENAI_API_KEY", None)
+os.environ.pop("LLM_CACHE_PATH", None)
+
+import httpx
+
+import app as shop
+from database import SessionLocal, User, Product, ProductStock, async_engine
+from seed_data import seed_all
+
+
+@pytest.fixture(scope="session", autouse=True)
+def seeded_db():
+    seed_all()
+
+
+_order_numbers = itertools.count(100000)
+
+
+@pytest.fixture(autouse=True)
+def unique_order_numbers(monkeypatch):
+    # checkout draws order numbers at random; hundreds of orders would collide on the unique column.
+    real_randint = random.randint
+    monkeypatch.setattr(
+        random, "randint",
+        lambda a, b: next(_order_numbers) if (a, b) == (100000, 999999) else real_randint(a, b)
+    )
+
+
+def run(coro_fn, *args):
+    """Runs `coro_fn(client, *args)` against the app on a fresh event loop."""
+    async def main():
+        transport = httpx.ASGITransport(app=shop.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+                return await coro_fn(client, *args)
+        finally:
+            # Pooled aiosqlite connections are bound to this loop.
+            await async_engine.dispose()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def make_user():
+    created = itertools.count(1)
+    
+    def make():
+        db = SessionLocal()
+        try:
+            n = next(created)
+            user = User(
+                full_name=f"Test User {n}",
+                email=f"user-{os.urandom(6).hex()}@example.com",
+                phone="9999999999",
+                city="Hyderabad",
+                nearest_store_id=1,
+                password_hash="x",
+                preferences={"categories": [], "sizes": ["M"]}
+            )
+            db.add(user)
+            db.commit()
+            token = shop.create_access_token(
+                data={"sub": user.email, "uid": user.id},
+                expires_delta=timedelta(minutes=30)
+            )
+            return user.id, {"Authorization": f"Bearer {token}"}
+        finally:
+            db.close()
+    return make
+
+
+@pytest.fixture
+def products():
+    db = SessionLocal()
+    try:
+        return [p.id for p in db.query(Product).order_by(Product.id).all()]
+    finally:
+        db.close()
+
+
+def set_central_stock(product_id, size, qty):
+    db = SessionLocal()
+    try:
+        row = db.query(ProductStock).filter_by(product_id=product_id, size=size, store_id=None).one()
+        row.qty = qty
+        row.reserved = 0
+        db.commit()
+    finally:
+        db.close()
+
+
+def central_stock(product_id, size):
+    db = SessionLocal()
+    try:
+        row = db.query(ProductStock).filter_by(product_id=product_id, size=size, store_id=None).one()
+        return row.qty, row.reserved
+    finally:
+        db.close()
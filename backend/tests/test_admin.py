@@ -0,0 +1,30 @@
+import pytest
+
+import app as shop
+from conftest import run
+
+ADMIN_ROUTES = [
+    ("GET", "/api/admin/db-pool"),
+    ("GET", "/api/admin/cache"),
+    ("POST", "/api/admin/embedding-index/sync"),
+]
+
+
+def call(method, path, headers=None):
+    async def request(client):
+        return await client.request(method, path, headers=headers or {})
+    return run(request)
+
+
+@pytest.mark.parametrize("method,path", ADMIN_ROUTES)
+def test_admin_routes_are_disabled_without_a_configured_token(monkeypatch, method, path):
+    monkeypatch.setattr(shop, "ADMIN_TOKEN", None)
+    assert call(method, path, {"X-Admin-Token": ""}).status_code == 404
+
+
+@pytest.mark.parametrize("method,path", ADMIN_ROUTES)
+def test_admin_routes_require_the_token(monkeypatch, method, path):
+    monkeypatch.setattr(shop, "ADMIN_TOKEN", "s3cret")
+    assert call(method, path).status_code == 403
+    assert call(method, path, {"X-Admin-Token": "wrong"}).status_code == 403
+    assert call(method, path, {"X-Admin-Token": "s3cret"}).status_code == 200
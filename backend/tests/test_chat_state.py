@@ -0,0 +1,50 @@
+from fashion_chatbot import ChatState, Step, SIZES, select_size
+
+
+def test_valid_sizes_share_the_canonical_string():
+    state = select_size(ChatState(user_input="xl", step=Step.SELECT_SIZE))
+    assert state.size is SIZES["XL"]
+    
+    restored = ChatState.from_dict({"size": "".join(["X", "L"])})
+    assert restored.size is SIZES["XL"]
+
+
+def test_unknown_sizes_are_kept_as_typed():
+    state = select_size(ChatState(user_input="size 42 please", step=Step.SELECT_SIZE))
+    assert state.size == "SIZE 42 PLEASE"
+    assert ChatState.from_dict({"size": "XXXL", "category": "capes"}).category == "capes"
+
+
+def test_stock_written_elsewhere_is_resynced_in_the_background(products):
+    from sqlalchemy import text
+    from conftest import run
+    from database import AsyncSessionLocal, engine
+    from fashion_chatbot import chat_catalogue
+    
+    product_id = products[0]
+    with engine.connect() as conn:
+        original = conn.execute(
+            text("SELECT id, qty FROM product_stock WHERE store_id IS NULL AND product_id = :p"), {"p": product_id}
+        ).all()
+    
+    async def resync(client):
+        async with AsyncSessionLocal() as db:
+            await chat_catalogue.refresh(db)
+            assert chat_catalogue.by_id[product_id]["stock"] > 0
+            # Another worker sells out the product; no change event reaches this process.
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE product_stock SET qty = 0, reserved = 0 WHERE store_id IS NULL AND product_id = :p"), {"p": product_id})
+            chat_catalogue._synced_at = 0.0
+            await chat_catalogue.refresh(db)
+            # The chat turn does not wait for the re-read.
+            assert chat_catalogue.by_id[product_id]["stock"] > 0
+            await chat_catalogue._resync
+        return chat_catalogue.by_id[product_id]["stock"]
+    
+    try:
+        assert run(resync) == 0
+    finally:
+        with engine.begin() as conn:
+            for row in original:
+                conn.execute(text("UPDATE product_stock SET qty = :q WHERE id = :i"), {"q": row.qty, "i": row.id})
+        chat_catalogue._loaded = False
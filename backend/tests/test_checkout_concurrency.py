@@ -0,0 +1,66 @@
+import asyncio
+
+from sqlalchemy import func
+
+from conftest import run, set_central_stock, central_stock
+from database import SessionLocal, CartItem, OrderItem
+
+STOCK = 50
+SHOPPERS = 300
+
+
+def sold(product_id, size):
+    db = SessionLocal()
+    try:
+        return db.query(func.coalesce(func.sum(OrderItem.quantity), 0)).filter(
+            OrderItem.product_id == product_id, OrderItem.size == size
+        ).scalar()
+    finally:
+        db.close()
+
+
+async def checkout_all(client, shoppers):
+    return await asyncio.gather(*[
+        client.post("/api/checkout", json={"order_type": "store", "payment_method": "upi"}, headers=headers)
+        for headers in shoppers
+    ])
+
+
+def test_reserved_checkouts_do_not_oversell(make_user, products):
+    product_id, size = products[0], "S"
+    set_central_stock(product_id, size, STOCK)
+    shoppers = [make_user()[1] for _ in range(SHOPPERS)]
+    
+    async def shop(client):
+        added = await asyncio.gather(*[
+            client.post("/api/cart", json={"product_id": product_id, "size": size, "quantity": 1}, headers=headers)
+            for headers in shoppers
+        ])
+        return added, await checkout_all(client, shoppers)
+    
+    added, checkouts = run(shop)
+    
+    assert sorted(r.status_code for r in added) == [200] * STOCK + [409] * (SHOPPERS - STOCK)
+    # Shoppers whose add was refused have an empty cart.
+    assert sorted(r.status_code for r in checkouts) == [200] * STOCK + [400] * (SHOPPERS - STOCK)
+    assert central_stock(product_id, size) == (0, 0)
+    assert sold(product_id, size) == STOCK
+
+
+def test_unreserved_checkouts_do_not_oversell(make_user, products):
+    product_id, size = products[1], "S"
+    set_central_stock(product_id, size, STOCK)
+    users = [make_user() for _ in range(SHOPPERS)]
+    db = SessionLocal()
+    try:
+        # Cart rows written directly, as for carts that predate reservations or whose hold expired.
+        db.add_all([CartItem(user_id=user_id, product_id=product_id, size=size, quantity=1) for user_id, _ in users])
+        db.commit()
+    finally:
+        db.close()
+    
+    checkouts = run(checkout_all, [headers for _, headers in users])
+    
+    assert sorted(r.status_code for r in checkouts) == [200] * STOCK + [409] * (SHOPPERS - STOCK)
+    assert central_stock(product_id, size) == (0, 0)
+    assert sold(product_id, size) == STOCK
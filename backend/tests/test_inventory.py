@@ -0,0 +1,76 @@
+import pytest
+
+from ai_agents import InventoryAgent
+from conftest import run, set_central_stock, central_stock
+from database import SessionLocal, AsyncSessionLocal, CartItem
+
+
+@pytest.mark.parametrize("quantity", [0, -3])
+def test_cart_rejects_non_positive_quantity(make_user, products, quantity):
+    set_central_stock(products[2], "M", 5)
+    _, headers = make_user()
+    
+    async def add(client):
+        return await client.post("/api/cart", json={"product_id": products[2], "size": "M", "quantity": quantity}, headers=headers)
+    
+    assert run(add).status_code == 422
+    assert central_stock(products[2], "M") == (5, 0)
+
+
+@pytest.mark.parametrize("quantity", [0, -3])
+def test_reserve_stock_rejects_non_positive_quantity(make_user, products, quantity):
+    set_central_stock(products[2], "M", 5)
+    user_id, _ = make_user()
+    
+    async def reserve(client):
+        async with AsyncSessionLocal() as db:
+            reserved = await InventoryAgent(db).reserve_stock(user_id, products[2], "M", quantity)
+            await db.commit()
+            return reserved
+    
+    assert run(reserve) is False
+    assert central_stock(products[2], "M") == (5, 0)
+
+
+def test_checkout_rejects_non_positive_cart_line(make_user, products):
+    set_central_stock(products[2], "M", 5)
+    user_id, headers = make_user()
+    db = SessionLocal()
+    try:
+        db.add(CartItem(user_id=user_id, product_id=products[2], size="M", quantity=-2))
+        db.commit()
+    finally:
+        db.close()
+    
+    async def checkout(client):
+        return await client.post("/api/checkout", json={"order_type": "store", "payment_method": "upi"}, headers=headers)
+    
+    assert run(checkout).status_code == 409
+    assert central_stock(products[2], "M") == (5, 0)
+
+
+def test_checkout_refreshes_cached_listings(make_user, products):
+    set_central_stock(products[2], "M", 5)
+    user_id, headers = make_user()
+    db = SessionLocal()
+    try:
+        db.add(CartItem(user_id=user_id, product_id=products[2], size="M", quantity=2))
+        db.commit()
+    finally:
+        db.close()
+    
+    async def listed_stock(client):
+        listing = (await client.get("/api/products", params={"fields": "id,pid,stock", "limit": 500})).json()
+        product = next(p for p in listing if p["id"] == products[2])
+        inventory = (await client.get("/api/agents/inventory")).json()["inventory"]
+        return product["stock"]["M"], next(p for p in inventory if p["pid"] == product["pid"])["stock"]["M"]
+    
+    async def checkout(client):
+        before = await listed_stock(client)
+        response = await client.post("/api/checkout", json={"order_type": "store", "payment_method": "upi"}, headers=headers)
+        assert response.status_code == 200
+        return before, await listed_stock(client)
+    
+    before, after = run(checkout)
+    assert before == (5, 5)
+    assert after == (3, 3)
@@ -0,0 +1,61 @@
+import asyncio
+
+import ai_agents
+from llm_cache import llm_cache
+
+
+def test_cached_answer_is_filled_with_each_callers_amounts(monkeypatch):
+    sent = []
+    
+    async def generate(client, system_prompt, user_message, timeout):
+        sent.append(user_message)
+        return "You saved {saved} on {total}!"
+    
+    monkeypatch.setattr(ai_agents, "get_openai_client", lambda: object())
+    monkeypatch.setattr(ai_agents, "_generate", generate)
+    llm_cache.clear()
+    
+    async def ask(saved, total):
+        return await ai_agents.ai_generate_response(
+            "system", "Customer saved {saved} on their purchase of {total}.",
+            placeholders={"{saved}": f"Rs.{saved}", "{total}": f"Rs.{total}"}
+        )
+    
+    assert asyncio.run(ask(234, 2345)) == "You saved Rs.234 on Rs.2345!"
+    assert asyncio.run(ask(231, 2310)) == "You saved Rs.231 on Rs.2310!"
+    assert sent == ["Customer saved {saved} on their purchase of {total}."]
+
+
+def test_model_receives_exact_amounts(monkeypatch):
+    sent = []
+    
+    async def generate(client, system_prompt, user_message, timeout):
+        sent.append(user_message)
+        return "ok"
+    
+    monkeypatch.setattr(ai_agents, "get_openai_client", lambda: object())
+    monkeypatch.setattr(ai_agents, "_generate", generate)
+    llm_cache.clear()
+    
+    asyncio.run(ai_agents.ai_generate_response("system", "Cart worth Rs.2345"))
+    assert sent == ["Cart worth Rs.2345"]
+
+
+def test_prompts_with_different_amounts_do_not_share_an_answer(monkeypatch):
+    sent = []
+    
+    async def generate(client, system_prompt, user_message, timeout):
+        sent.append(user_message)
+        return f"answer to {user_message}"
+    
+    monkeypatch.setattr(ai_agents, "get_openai_client", lambda: object())
+    monkeypatch.setattr(ai_agents, "_generate", generate)
+    llm_cache.clear()
+    
+    async def ask(prompt):
+        return await ai_agents.ai_generate_response("system", prompt)
+    
+    assert asyncio.run(ask("Cart worth Rs.2345")) == "answer to Cart worth Rs.2345"
+    assert asyncio.run(ask("Cart worth Rs.2310")) == "answer to Cart worth Rs.2310"
+    assert asyncio.run(ask("Cart  worth\nRs.2345")) == "answer to Cart worth Rs.2345"
+    assert sent == ["Cart worth Rs.2345", "Cart worth Rs.2310"]
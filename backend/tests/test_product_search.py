@@ -0,0 +1,60 @@
+import base64
+import json
+
+import pytest
+
+from conftest import run
+from retrieval import BM25Index
+
+
+def test_unmatched_terms_are_read_as_prefixes():
+    index = BM25Index()
+    index.add(1, "Blue Oxford Shirt")
+    index.add(2, "Slim Chino Pants")
+    
+    assert [doc for doc, _ in index.search("shi")] == [1]
+    assert index.search("sh") == []
+    index.remove(1)
+    assert index.search("shi") == []
+
+
+def fetch_all(params):
+    async def pages(client):
+        items, cursor = [], None
+        while True:
+            response = await client.get("/api/products", params={**params, **({"cursor": cursor} if cursor else {})})
+            assert response.status_code == 200
+            items += response.json()
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                return items
+    return run(pages)
+
+
+def test_prefix_search_finds_products():
+    assert fetch_all({"search": "shi", "limit": 500})
+
+
+def test_search_sorted_by_price_pages_through_every_match():
+    everything = fetch_all({"search": "shirt", "sort": "relevance", "limit": 500})
+    paged = fetch_all({"search": "shirt", "sort": "-price", "limit": 7, "fields": "id,price"})
+    
+    assert sorted(p["id"] for p in paged) == sorted(p["id"] for p in everything)
+    assert [(p["price"], p["id"]) for p in paged] == sorted(((p["price"], p["id"]) for p in paged), reverse=True)
+
+
+@pytest.mark.parametrize("params, values", [
+    ({"sort": "price"}, ["abc", 5]),
+    ({"sort": "-price"}, [10.5, "5"]),
+    ({"sort": "id"}, [1.5]),
+    ({"sort": "id"}, [True]),
+    ({"search": "shirt", "sort": "price"}, [None, 5]),
+    ({"search": "shirt"}, ["10"]),
+])
+def test_cursor_values_must_match_the_sort_columns(params, values):
+    cursor = base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+    
+    async def fetch(client):
+        return await client.get("/api/products", params={**params, "cursor": cursor})
+    
+    assert run(fetch).status_code == 400
@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from conftest import run
+from database import SessionLocal, CartItem, Order, OrderItem, async_engine
+
+
+@contextmanager
+def count_statements():
+    statements = []
+    
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(async_engine.sync_engine, "before_cursor_execute", on_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", on_execute)
+
+
+def add_cart_items(user_id, product_ids):
+    db = SessionLocal()
+    try:
+        for product_id in product_ids:
+            db.add(CartItem(user_id=user_id, product_id=product_id, size="M", quantity=1))
+        db.commit()
+    finally:
+        db.close()
+
+
+def add_orders(user_id, count, items_per_order, product_ids):
+    db = SessionLocal()
+    try:
+        for n in range(count):
+            order = Order(
+                order_number=f"QC{user_id}-{n}", user_id=user_id, total_amount=100, discount_amount=0,
+                final_amount=100, payment_method="upi", payment_status="paid", order_type="online", status="confirmed"
+            )
+            db.add(order)
+            db.flush()
+            for product_id in product_ids[:items_per_order]:
+                db.add(OrderItem(order_id=order.id, product_id=product_id, size="M", quantity=1, price=100))
+        db.commit()
+    finally:
+        db.close()
+
+
+def statements_for(path, headers):
+    async def fetch(client):
+        # Warm the user and catalogue caches so only the endpoint's own queries are counted.
+        assert (await client.get(path, headers=headers)).status_code == 200
+        with count_statements() as statements:
+            response = await client.get(path, headers=headers)
+        assert response.status_code == 200
+        return len(statements)
+    return run(fetch)
+
+
+def test_cart_query_count_is_independent_of_item_count(make_user, products):
+    small_id, small = make_user()
+    large_id, large = make_user()
+    add_cart_items(small_id, products[:1])
+    add_cart_items(large_id, products[:6])
+    
+    assert statements_for("/api/cart", small) == statements_for("/api/cart", large)
+
+
+def test_orders_query_count_is_independent_of_order_count(make_user, products):
+    small_id, small = make_user()
+    large_id, large = make_user()
+    add_orders(small_id, 1, 1, products)
+    add_orders(large_id, 4, 3, products)
+    
+    assert statements_for("/api/orders", small) == statements_for("/api/orders", large)
+
+
+def test_dashboard_query_count_is_independent_of_history(make_user, products):
+    small_id, small = make_user()
+    large_id, large = make_user()
+    add_orders(small_id, 1, 1, products)
+    add_orders(large_id, 4, 6, products)
+    
+    assert statements_for("/api/dashboard", small) == statements_for("/api/dashboard", large)
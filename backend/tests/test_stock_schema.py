@@ -0,0 +1,28 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal, ProductStock
+
+
+def test_central_stock_is_unique_per_product_and_size(products):
+    db = SessionLocal()
+    try:
+        db.add(ProductStock(product_id=products[0], size="M", store_id=None, qty=1))
+        with pytest.raises(IntegrityError):
+            db.commit()
+    finally:
+        db.rollback()
+        db.close()
+
+
+def test_store_stock_rows_are_separate_from_central(products):
+    db = SessionLocal()
+    try:
+        row = ProductStock(product_id=products[0], size="M", store_id=1, qty=1)
+        db.add(row)
+        db.commit()
+        db.delete(row)
+        db.commit()
+    finally:
+        db.close()
+
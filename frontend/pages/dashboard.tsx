@@ -35,7 +35,7 @@ interface Product {
   description: string;
   category: string;
   price: number;
-  stock: { S: number; M: number; L: number; XL: number };
+  stock: Record<string, number>;
 }
 
 interface CartItem {
@@ -84,12 +84,17 @@ interface ChatMessage {
   content: string;
 }
 
+// Products per /api/products page; the catalog loads further pages on demand.
+const PRODUCT_PAGE_SIZE = 100;
+
 export default function Dashboard() {
   const router = useRouter();
   const [currentView, setCurrentView] = useState<ViewType>("dashboard");
   const [user, setUser] = useState<any>(null);
   const [dashboardData, setDashboardData] = useState<any>(null);
   const [products, setProducts] = useState<Product[]>([]);
+  const [productsCursor, setProductsCursor] = useState<string | null>(null);
+  const [loadingProducts, setLoadingProducts] = useState(false);
   const [filteredProducts, setFilteredProducts] = useState<Product[]>([]);
   const [cart, setCart] = useState<{ items: CartItem[]; total: number }>({
     items: [],
@@ -175,7 +180,7 @@ export default function Dashboard() {
       const [dashRes, productsRes, cartRes, offersRes, ordersRes] =
         await Promise.all([
           authFetch("/api/dashboard"),
-          fetch("/api/products"),
+          fetch(`/api/products?limit=${PRODUCT_PAGE_SIZE}`),
           authFetch("/api/cart"),
           fetch("/api/agents/offers"),
           authFetch("/api/orders"),
@@ -186,7 +191,10 @@ export default function Dashboard() {
         setDashboardData(data);
         setUser(data.profile);
       }
-      if (productsRes.ok) setProducts(await productsRes.json());
+      if (productsRes.ok) {
+        setProducts(await productsRes.json());
+        setProductsCursor(productsRes.headers.get("X-Next-Cursor"));
+      }
       if (cartRes.ok) setCart(await cartRes.json());
       if (offersRes.ok) setOffers(await offersRes.json());
       if (ordersRes.ok) setOrders(await ordersRes.json());
@@ -197,6 +205,25 @@ export default function Dashboard() {
     }
   };
 
+  const loadMoreProducts = async () => {
+    if (!productsCursor) return;
+    setLoadingProducts(true);
+    try {
+      const res = await fetch(
+        `/api/products?limit=${PRODUCT_PAGE_SIZE}&cursor=${encodeURIComponent(productsCursor)}`,
+      );
+      if (res.ok) {
+        const page: Product[] = await res.json();
+        setProducts((prev) => [...prev, ...page]);
+        setProductsCursor(res.headers.get("X-Next-Cursor"));
+      }
+    } catch (error) {
+      console.error("Error loading products:", error);
+    } finally {
+      setLoadingProducts(false);
+    }
+  };
+
   const addToCart = async (productId: number, size: string = "M") => {
     const res = await authFetch("/api/cart", {
       method: "POST",
@@ -216,6 +243,18 @@ export default function Dashboard() {
     }
   };
 
+  const loadAiMessage = async (enrichmentId: string) => {
+    try {
+      const res = await authFetch(`/api/agents/messages/${enrichmentId}?wait=10`);
+      if (res.ok) {
+        const data = await res.json();
+        if (data.message) setAiMessage(data.message);
+      }
+    } catch (error) {
+      console.error("AI message error:", error);
+    }
+  };
+
   const handleCheckout = async () => {
     setLoading(true);
     try {
@@ -232,7 +271,8 @@ export default function Dashboard() {
 
       if (data.success) {
         setOrderResult(data.order);
-        if (data.ai_message) setAiMessage(data.ai_message);
+        if (data.pricing?.ai_message) setAiMessage(data.pricing.ai_message);
+        if (data.pricing?.enrichment_id) loadAiMessage(data.pricing.enrichment_id);
         if (data.store_slots) setStoreSlots(data.store_slots);
         setCheckoutStep(orderType === "store" ? 4 : 5);
         setCart({ items: [], total: 0 });
@@ -915,6 +955,18 @@ export default function Dashboard() {
           </div>
         ))}
       </div>
+
+      {productsCursor && (
+        <div style={{ display: "flex", justifyContent: "center", marginTop: 32 }}>
+          <button
+            onClick={loadMoreProducts}
+            className="btn-secondary"
+            disabled={loadingProducts}
+          >
+            {loadingProducts ? "Loading..." : "Load more products"}
+          </button>
+        </div>
+      )}
     </div>
   );
 
@@ -1890,16 +1942,44 @@ export default function Dashboard() {
     setChatLoading(true);
 
     try {
-      const res = await authFetch("/api/chat", {
+      const res = await authFetch("/api/chat/stream", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ message: userMessage, session_id: chatSessionId }),
       });
-      const data = await res.json();
-      setChatSessionId(data.session_id);
-      setChatMessages((prev) => [...prev, { role: "assistant", content: data.response }]);
-      if (data.ended) {
-        setChatEnded(true);
+      if (!res.ok || !res.body) throw new Error(`Chat stream failed: ${res.status}`);
+
+      setChatMessages((prev) => [...prev, { role: "assistant", content: "" }]);
+      const appendToReply = (text: string) =>
+        setChatMessages((prev) => {
+          const last = prev[prev.length - 1];
+          return [...prev.slice(0, -1), { ...last, content: last.content + text }];
+        });
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const raw = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const payload = raw.match(/^data: (.*)$/m)?.[1];
+          if (!payload) continue;
+          const data = JSON.parse(payload);
+          if (event === "delta") {
+            appendToReply(data.text);
+          } else if (event === "done") {
+            setChatSessionId(data.session_id);
+            if (data.ended) {
+              setChatEnded(true);
+            }
+          }
+        }
       }
     } catch (error) {
       console.error("Failed to send message:", error);